@@ -0,0 +1,132 @@
+"""
+Benchmark do caminho de (de)serialização do POST /chat.
+
+Compara, para históricos de 10, 50 e 200 mensagens:
+  - pydantic: ChatRequest validado pelo pydantic + varreduras do histórico + ChatResponse serializado
+    (o fluxo antigo do bot_api.py, reproduzido abaixo)
+  - compacto: chat_historico.py (slots, roles internados, flags, codec JSON rápido)
+
+Mede µs por requisição e bytes alocados (pico do tracemalloc) por requisição.
+Uso: python benchmark_historico.py
+"""
+import time
+import tracemalloc
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from chat_historico import json_dumps, decodificar_requisicao_chat, codificar_resposta_chat
+
+TAMANHOS = [10, 50, 200]
+REPETICOES = 2000
+
+
+# --- Modelos e laço antigos (simplificados da bot_api.py) ---
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+class ChatSession(BaseModel):
+    session_id: Optional[str] = None
+    nome_cliente: str = "visitante"
+    formacao_cliente: Optional[str] = None
+    tipo_formacao: Optional[str] = None
+    area_preferencial: Optional[str] = None
+    historico: List[ChatMessage] = []
+    curso_contexto: Optional[str] = None
+
+class ChatRequest(BaseModel):
+    mensagem: str
+    session: ChatSession
+
+class ChatResponse(BaseModel):
+    resposta_bot: str
+    session_atualizada: ChatSession
+    navegar_para: Optional[str] = None
+
+
+def requisicao_pydantic(corpo: bytes) -> bytes:
+    request = ChatRequest.model_validate_json(corpo)
+    session = request.session
+    historico_recente_bot = [msg for msg in session.historico if msg.role == "assistant"]
+    _ = historico_recente_bot[-1].content.lower() if historico_recente_bot else ""
+    session.historico.append(ChatMessage(role="user", content=request.mensagem))
+    dados = None
+    for msg in reversed(session.historico):
+        if "[DADOS_CURSO_ENCONTRADO:" in msg.content:
+            dados = msg.content.replace("HIDDEN:", "")
+            break
+    historico_limpo_str = ""
+    for msg in session.historico[-10:]:
+        if not msg.content.startswith("HIDDEN:") and not msg.content.startswith("[DADOS_CURSO_ENCONTRADO:"):
+            role_str = "Bot" if msg.role in ["bot", "assistant"] else "Usuário"
+            historico_limpo_str += f"{role_str}: {msg.content}\n"
+    session.historico.append(ChatMessage(role="assistant", content="Resposta do bot."))
+    return ChatResponse(resposta_bot="Resposta do bot.", session_atualizada=session).model_dump_json().encode()
+
+
+def requisicao_compacta(corpo: bytes) -> bytes:
+    mensagem, session = decodificar_requisicao_chat(corpo)
+    ultima = session.historico.ultima_do_bot()
+    _ = ultima.content.lower() if ultima else ""
+    session.historico.append("user", mensagem)
+    dados = session.historico.ultimos_dados_curso()
+    historico_limpo_str = "".join(
+        f"{'Bot' if msg.role in ('bot', 'assistant') else 'Usuário'}: {msg.content}\n"
+        for msg in session.historico.visiveis_recentes(10)
+    )
+    session.historico.append("assistant", "Resposta do bot.")
+    return codificar_resposta_chat("Resposta do bot.", session, None)
+
+
+# --- Payload sintético ---
+def montar_corpo(n: int) -> bytes:
+    historico = []
+    for i in range(n):
+        if i % 8 == 7:
+            content = "HIDDEN:\n    [DADOS_CURSO_ENCONTRADO: NEUROPSICOPEDAGOGIA]\n" + "    - Campo: valor do curso\n" * 30
+        elif i % 2 == 0:
+            content = f"Mensagem {i} do usuário perguntando sobre valores e duração do curso."
+        else:
+            content = f"Resposta {i} do bot com detalhes sobre a pós-graduação, modalidade EAD e formas de pagamento. " * 3
+        historico.append({"role": "user" if i % 2 == 0 else "assistant", "content": content})
+    return json_dumps({
+        "mensagem": "quanto custa no pix?",
+        "session": {
+            "session_id": "0b7d3c1e-8a53-4c5f-9b84-3e7f4d1c2a90",
+            "nome_cliente": "Maria",
+            "formacao_cliente": "Licenciado em pedagogia",
+            "tipo_formacao": "Licenciado",
+            "area_preferencial": "Educação",
+            "historico": historico,
+            "curso_contexto": "NEUROPSICOPEDAGOGIA - Pós-Graduação - EAD",
+        },
+    })
+
+
+def medir_tempo_us(funcao, corpo: bytes) -> float:
+    inicio = time.perf_counter()
+    for _ in range(REPETICOES):
+        funcao(corpo)
+    return (time.perf_counter() - inicio) / REPETICOES * 1e6
+
+
+def medir_alocacao(funcao, corpo: bytes) -> int:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    funcao(corpo)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return pico - base
+
+
+if __name__ == "__main__":
+    print(f"{'msgs':>5} | {'caminho':<9} | {'µs/req':>9} | {'bytes alocados':>15}")
+    print("-" * 48)
+    for n in TAMANHOS:
+        corpo = montar_corpo(n)
+        assert len(requisicao_pydantic(corpo)) > 0 and len(requisicao_compacta(corpo)) > 0
+        for nome, funcao in (("pydantic", requisicao_pydantic), ("compacto", requisicao_compacta)):
+            funcao(corpo)  # aquecimento
+            print(f"{n:>5} | {nome:<9} | {medir_tempo_us(funcao, corpo):>9.1f} | {medir_alocacao(funcao, corpo):>15,}")
@@ -1,14 +1,29 @@
 import os
 import json
 import re
-from typing import Tuple, List, Optional, Dict
+import uuid
+import hmac
+import hashlib
+import base64
+import csv
+import io
+from datetime import datetime, timezone
+from typing import Tuple, List, Optional, Dict, Iterator
 from supabase import create_client, Client
 import google.generativeai as genai
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse
+from pydantic import BaseModel, ValidationError
 import uvicorn
+from chat_historico import SessaoChat, MensagemHistorico, decodificar_requisicao_chat, codificar_resposta_chat, json_loads
+from diagnostico import HEADER_RASTREIO, etapa, rastrear, capturar_perfil
+from idempotencia import CoordenadorIdempotencia, ConflitoIdempotencia, impressao_digital, montar_chave
+from cache_respostas import CacheRespostas, normalizar_pergunta, versao_de, para_template, personalizar
+from roteador_modelos import RoteadorModelos, NivelModelo, classificar_turno
 
 # === CONFIGURAÇÕES ===
 print("LOG (Python): Carregando variáveis de ambiente...")
@@ -16,34 +31,85 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Chave para assinar os session_id emitidos pelo servidor (padrão: derivada da SUPABASE_KEY)
+SESSION_ID_SECRET = os.getenv("SESSION_ID_SECRET") or f"chat-session:{SUPABASE_KEY}"
 
 # Conexões
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# === NÍVEIS DE MODELO (ÚNICO LUGAR DE CONFIGURAÇÃO) ===
+# classificar_turno (roteador_modelos.py) escolhe o nível; se ele não responder dentro do
+# orçamento de latência, o nível em NIVEL_RESERVA recebe uma requisição hedge.
+# Preços em US$ por 1M de tokens (entrada / saída), usados no relatório de custo.
+NIVEIS_MODELO = {
+    "rapido": {
+        "modelo": "gemini-2.5-flash-lite",
+        "temperature": 0.5, "top_p": 0.8, "top_k": 40,
+        "orcamento_s": 4.0,
+        "custo_entrada_1m": 0.10, "custo_saida_1m": 0.40,
+    },
+    "padrao": {
+        "modelo": "gemini-2.5-flash",
+        "temperature": 0.5, "top_p": 0.8, "top_k": 40,
+        "orcamento_s": 8.0,
+        "custo_entrada_1m": 0.30, "custo_saida_1m": 2.50,
+    },
+}
+NIVEL_RESERVA = {"rapido": "padrao", "padrao": "rapido"}
+
+# Saída estruturada: o Gemini devolve JSON neste formato em vez de tags no texto
+SCHEMA_RESPOSTA_IA = {
+    "type": "object",
+    "properties": {
+        "resposta": {"type": "string"},
+        "acao": {"type": "string", "enum": ["nenhuma", "buscar", "navegar"]},
+        "termo_busca": {"type": "string"},
+    },
+    "required": ["resposta", "acao"],
+}
+
+def criar_roteador_modelos() -> RoteadorModelos:
+    niveis = {}
+    for nome, cfg in NIVEIS_MODELO.items():
+        niveis[nome] = NivelModelo(
+            nome,
+            genai.GenerativeModel(cfg["modelo"]),
+            genai.GenerationConfig(
+                temperature=cfg["temperature"], top_p=cfg["top_p"], top_k=cfg["top_k"],
+                response_mime_type="application/json", response_schema=SCHEMA_RESPOSTA_IA,
+            ),
+            orcamento_s=cfg["orcamento_s"],
+            custo_entrada_1m=cfg["custo_entrada_1m"],
+            custo_saida_1m=cfg["custo_saida_1m"],
+        )
+    return RoteadorModelos(niveis, NIVEL_RESERVA)
+
 try:
     genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    print("LOG (Python): Conexão com Supabase e Gemini (2.5-flash) configurada.")
+    roteador_modelos = criar_roteador_modelos()
+    print(f"LOG (Python): Conexão com Supabase e Gemini configurada. Níveis: { {n: c['modelo'] for n, c in NIVEIS_MODELO.items()} }")
 except Exception as e:
     print(f"ERRO CRÍTICO (Python): Falha ao iniciar cliente Gemini: {e}")
-    model = None
-
-configuracao_geracao = genai.GenerationConfig(
-    temperature=0.5,
-    top_p=0.8,
-    top_k=40
-)
+    roteador_modelos = None
 
 PROMPTS_MODULARES: Dict[str, str] = {}
 PROMPTS_CARREGADOS = False
+VERSAO_PROMPTS = ""
+# Aumente ao mudar o texto fixo de montar_prompt_base / prompt_final (invalida o cache de respostas)
+VERSAO_TEMPLATE_PROMPT = "3"
+
+# Respostas do Gemini reaproveitadas entre visitantes (mesmo curso + mesma pergunta + mesmo perfil)
+cache_respostas = CacheRespostas()
+CAMPOS_PERFIL_CACHE = ("tipo_formacao", "formacao_cliente", "area_preferencial")
 
 # === FUNÇÃO DE CARREGAMENTO DE PROMPTS ===
 def carregar_prompts_do_supabase() -> bool:
-    global PROMPTS_MODULARES, PROMPTS_CARREGADOS
+    global PROMPTS_MODULARES, PROMPTS_CARREGADOS, VERSAO_PROMPTS
     print("LOG (Python): Carregando prompts modulares do Supabase...")
     try:
         # Nota: Selecionamos apenas prompts ATIVOS, o que é o comportamento correto.
-        response = supabase.table("agent_prompts").select("nome_chave, conteudo").eq('ativo', True).execute()
+        with etapa("db"):
+            response = supabase.table("agent_prompts").select("nome_chave, conteudo").eq('ativo', True).execute()
         
         if not response.data:
             print("!!! ERRO CRÍTICO (Python): Nenhum prompt encontrado no Supabase.")
@@ -56,6 +122,10 @@ def carregar_prompts_do_supabase() -> bool:
                 PROMPTS_MODULARES[prompt['nome_chave']] = prompt['conteudo']
         
         print(f"LOG (Python): {len(PROMPTS_MODULARES)} prompts carregados com sucesso.")
+        nova_versao = versao_de(PROMPTS_MODULARES)
+        if nova_versao != VERSAO_PROMPTS:
+            VERSAO_PROMPTS = nova_versao
+            cache_respostas.limpar()
         PROMPTS_CARREGADOS = True
         return True
     except Exception as e:
@@ -64,18 +134,180 @@ def carregar_prompts_do_supabase() -> bool:
         return False
 
 # === NOVA FUNÇÃO PARA SALVAR NO BANCO ===
-def salvar_mensagem(session_id: str, role: str, content: str):
-    """Salva uma mensagem individual na tabela chat_messages do Supabase"""
+def salvar_mensagem(
+    session_id: str,
+    role: str,
+    content: str,
+    ramo: Optional[str] = None,
+    curso_contexto: Optional[str] = None,
+    navegar_para: Optional[str] = None,
+):
+    """
+    Salva uma mensagem individual na tabela chat_messages do Supabase.
+    'ramo' identifica o caminho de gerar_resposta_usuario que produziu a mensagem; junto com
+    o curso e a navegação, alimenta os rollups do trigger atualizar_chat_rollups.
+    """
     try:
         content_to_save = content.replace("HIDDEN:", "")
-        supabase.table("chat_messages").insert({
-            "session_id": session_id,
-            "role": role,
-            "content": content_to_save
-        }).execute()
+        with etapa("persistencia"):
+            supabase.table("chat_messages").insert({
+                "session_id": session_id,
+                "role": role,
+                "content": content_to_save,
+                "ramo": ramo,
+                "curso_contexto": curso_contexto,
+                "navegar_para": navegar_para,
+            }).execute()
     except Exception as e:
         print(f"!!! ERRO AO SALVAR MENSAGEM NO DB: {e}")
 
+CAMPOS_PERFIL_SESSAO = ["nome_cliente", "formacao_cliente", "tipo_formacao", "area_preferencial", "curso_contexto"]
+
+def salvar_perfil_sessao(session: SessaoChat):
+    """
+    Grava o perfil atual da conversa em chat_sessoes (uma linha por session_id).
+    O nome e as etiquetas não vão para chat_messages; o painel admin e a retomada leem daqui.
+    """
+    if not session.session_id:
+        return
+    try:
+        with etapa("persistencia"):
+            supabase.table("chat_sessoes").upsert({
+                "session_id": session.session_id,
+                **{campo: getattr(session, campo) for campo in CAMPOS_PERFIL_SESSAO},
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }).execute()
+    except Exception as e:
+        print(f"!!! ERRO AO SALVAR PERFIL DA SESSÃO NO DB: {e}")
+
+def buscar_perfil_sessao(session_id: str) -> Optional[Dict]:
+    response = (
+        supabase.table("chat_sessoes")
+        .select(", ".join(CAMPOS_PERFIL_SESSAO))
+        .eq("session_id", session_id)
+        .limit(1)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+# === HISTÓRICO DA CONVERSA (PAGINAÇÃO KEYSET) ===
+def codificar_cursor_historico(created_at: str, msg_id: str) -> str:
+    """Cursor opaco (created_at + id da última mensagem da página), seguro para URL."""
+    bruto = f"{created_at}|{msg_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(bruto).decode("ascii")
+
+def decodificar_cursor_historico(cursor: str) -> Tuple[str, str]:
+    bruto = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    created_at, msg_id = bruto.split("|", 1)
+    # Valida os dois campos antes de interpolá-los no filtro do PostgREST (levanta ValueError)
+    datetime.fromisoformat(created_at)
+    uuid.UUID(msg_id)
+    return created_at, msg_id
+
+ROLES_HISTORICO_PUBLICO = ("user", "assistant")
+
+def buscar_historico_sessao(session_id: str, limite: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Lê uma página do histórico de UMA conversa, da mais recente para a mais antiga.
+    Usa o índice (session_id, created_at, id): o custo depende só do tamanho da conversa/página.
+    Retorna as mensagens em ordem cronológica e o cursor para a página anterior (ou None).
+    Endpoint público: só as mensagens que o próprio cliente viu (user/assistant).
+    """
+    query = (
+        supabase.table("chat_messages")
+        .select("id, role, content, created_at")
+        .eq("session_id", session_id)
+        .in_("role", list(ROLES_HISTORICO_PUBLICO))  # Sem system_error (texto de exceção)
+    )
+    if cursor:
+        created_at, msg_id = decodificar_cursor_historico(cursor)
+        # (created_at, id) < (cursor) -- desempate pelo id para mensagens no mesmo instante
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{msg_id})')
+
+    # Pedimos 1 linha a mais só para saber se existe página seguinte
+    response = query.order("created_at", desc=True).order("id", desc=True).limit(limite + 1).execute()
+    linhas = response.data or []
+
+    proximo_cursor = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        proximo_cursor = codificar_cursor_historico(ultima["created_at"], ultima["id"])
+
+    linhas.reverse()
+    return linhas, proximo_cursor
+
+# === EXPORTAÇÃO E ROLLUPS DO CHAT (ADMIN) ===
+COLUNAS_EXPORTACAO = ["id", "session_id", "role", "content", "ramo", "curso_contexto", "navegar_para", "created_at"]
+TAMANHO_PAGINA_EXPORTACAO = 1000
+
+RAMOS_BYPASS = {"bypass_carga_horaria", "bypass_artigo_estagio", "bypass_ementa", "bypass_selecao_numerica", "cache_resposta"}
+RAMOS_LLM = {"llm_conversa", "llm_navegacao", "llm_busca_vazia", "llm_busca_vazia_contexto", "llm_busca_redundante", "llm_busca_unica", "llm_busca_lista"}
+RAMOS_BUSCA_VAZIA = {"llm_busca_vazia", "llm_busca_vazia_contexto"}
+
+def iterar_mensagens_exportacao(desde: Optional[str] = None, ate: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Percorre chat_messages em ordem (created_at, id) com paginação keyset.
+    Apenas uma página fica em memória por vez: exportações grandes usam memória constante.
+    """
+    ultimo: Optional[Tuple[str, str]] = None
+    while True:
+        query = supabase.table("chat_messages").select(", ".join(COLUNAS_EXPORTACAO))
+        if desde: query = query.gte("created_at", desde)
+        if ate: query = query.lt("created_at", ate)
+        if ultimo:
+            created_at, msg_id = ultimo
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{msg_id})')
+
+        linhas = query.order("created_at").order("id").limit(TAMANHO_PAGINA_EXPORTACAO).execute().data or []
+        yield from linhas
+
+        if len(linhas) < TAMANHO_PAGINA_EXPORTACAO:
+            return
+        ultimo = (linhas[-1]["created_at"], linhas[-1]["id"])
+
+def formatar_ndjson(linhas: Iterator[Dict]) -> Iterator[str]:
+    for linha in linhas:
+        yield json.dumps(linha, ensure_ascii=False) + "\n"
+
+def formatar_csv(linhas: Iterator[Dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUNAS_EXPORTACAO, extrasaction="ignore")
+    writer.writeheader()
+    for linha in linhas:
+        writer.writerow(linha)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def buscar_rollups_chat(desde: Optional[str] = None, ate: Optional[str] = None) -> Dict:
+    """Lê os contadores pré-calculados (chat_rollups_diarios) e monta o resumo do funil."""
+    query = supabase.table("chat_rollups_diarios").select("dia, curso, ramo, mensagens, sessoes_novas, navegacoes")
+    if desde: query = query.gte("dia", desde)
+    if ate: query = query.lte("dia", ate)
+    linhas = query.order("dia").execute().data or []
+
+    resumo = {"sessoes": 0, "turnos_usuario": 0, "turnos_llm": 0, "turnos_bypass": 0, "erros": 0, "buscas_sem_resultado": 0, "buscas_redundantes": 0, "navegacoes": 0}
+    por_curso: Dict[str, Dict[str, int]] = {}
+    for linha in linhas:
+        ramo = linha["ramo"]
+        mensagens = linha["mensagens"]
+        resumo["sessoes"] += linha["sessoes_novas"]
+        resumo["navegacoes"] += linha["navegacoes"]
+        if ramo == "mensagem_usuario": resumo["turnos_usuario"] += mensagens
+        elif ramo in RAMOS_LLM: resumo["turnos_llm"] += mensagens
+        elif ramo in RAMOS_BYPASS: resumo["turnos_bypass"] += mensagens
+        else: resumo["erros"] += mensagens
+        if ramo in RAMOS_BUSCA_VAZIA: resumo["buscas_sem_resultado"] += mensagens
+        elif ramo == "llm_busca_redundante": resumo["buscas_redundantes"] += mensagens
+
+        curso = por_curso.setdefault(linha["curso"] or "(sem curso)", {"mensagens": 0, "navegacoes": 0})
+        curso["mensagens"] += mensagens
+        curso["navegacoes"] += linha["navegacoes"]
+
+    return {"resumo": resumo, "por_curso": por_curso, "linhas": linhas}
+
 # === FUNÇÃO PARA MONTAR O PROMPT BASE ===
 def montar_prompt_base(perfil_cliente_prompt: str, dados_curso_injetados: Optional[str] = None) -> str:
     global PROMPTS_MODULARES
@@ -102,7 +334,7 @@ def montar_prompt_base(perfil_cliente_prompt: str, dados_curso_injetados: Option
 ---
 ### 8. REGRA DE NAVEGAÇÃO
 - Se o cliente pedir para "ir para a página do curso", "ver o curso", "me matricular" ou "quero comprar", e você souber DE QUAL CURSO ele está falando (seja pelo 'Contexto de Página' ou por um `[DADOS_CURSO_ENCONTRADO]` no histórico):
-- Responda de forma afirmativa (ex: "Claro, estou te redirecionando...") E ADICIONE a tag `[NAVEGAR_PARA]` na última linha.
+- Responda de forma afirmativa em "resposta" (ex: "Claro, estou te redirecionando...") e use "acao": "navegar".
 ---
 """
     
@@ -114,13 +346,13 @@ def montar_prompt_base(perfil_cliente_prompt: str, dados_curso_injetados: Option
 - Se o dado diz "Prazo de Conclusão: Mínimo 6", você DEVE dizer que são **6 meses**.
 - NÃO use a "Carga Horária" para chutar a duração em meses. Use o campo "Tempo de Conclusão".
 - Se você não sabe uma informação, diga que vai verificar com a secretaria, NÃO INVENTE.
-- Se for buscar um curso, sua resposta de usuário deve ser neutra (ex: "Vou verificar...") e a tag `[CURSO_BUSCA] NOME DO CURSO` deve vir DEPOIS, em uma nova linha.
+- Se for buscar um curso, sua "resposta" deve ser neutra (ex: "Vou verificar..."), com "acao": "buscar" e o NOME DO CURSO em "termo_busca".
 ---
 ### 10. REGRA DE CONTEXTO ATIVO (CRÍTICO)
 - Se o campo 'Contexto de Página (Curso)' no PERFIL DO CLIENTE já estiver preenchido com um curso:
-- **NÃO USE** a tag `[CURSO_BUSCA]` para procurar esse mesmo curso novamente ou cursos similares.
+- **NÃO USE** "acao": "buscar" para procurar esse mesmo curso novamente ou cursos similares.
 - Assuma que você JÁ TEM os dados dele no bloco `[DADOS_CURSO_ENCONTRADO]`.
-- Use `[CURSO_BUSCA]` **SOMENTE** se o cliente disser EXPLICITAMENTE: "quero ver outro curso", "mudar de curso", "busque por X".
+- Use "acao": "buscar" **SOMENTE** se o cliente disser EXPLICITAMENTE: "quero ver outro curso", "mudar de curso", "busque por X".
 ---
 """
 
@@ -156,6 +388,7 @@ class ChatMessage(BaseModel):
     content: str
 
 class ChatSession(BaseModel):
+    session_id: Optional[str] = None # Gerado pelo servidor na primeira mensagem
     nome_cliente: str = "visitante"
     formacao_cliente: Optional[str] = None
     tipo_formacao: Optional[str] = None
@@ -172,6 +405,25 @@ class ChatResponse(BaseModel):
     session_atualizada: ChatSession
     navegar_para: Optional[str] = None
 
+class HistoricoMensagem(BaseModel):
+    id: str
+    role: str
+    content: str
+    created_at: str
+
+class PerfilSessao(BaseModel):
+    nome_cliente: str = "visitante"
+    formacao_cliente: Optional[str] = None
+    tipo_formacao: Optional[str] = None
+    area_preferencial: Optional[str] = None
+    curso_contexto: Optional[str] = None
+
+class HistoricoResponse(BaseModel):
+    session_id: str
+    mensagens: List[HistoricoMensagem]
+    proximo_cursor: Optional[str] = None
+    perfil: Optional[PerfilSessao] = None # Só na primeira página (sem cursor)
+
 # === INICIALIZAÇÃO DA API ===
 app = FastAPI()
 app.add_middleware(
@@ -180,10 +432,64 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Idempotent-Replayed"],
 )
 
+# Coalescência de requisições repetidas do /chat (retries, duplo clique)
+idempotencia_chat = CoordenadorIdempotencia()
+
+# === AUTENTICAÇÃO DE ADMIN ===
+def verificar_admin(authorization: Optional[str] = Header(None)) -> str:
+    """Dependência das rotas /admin: exige o JWT do Supabase de um usuário com role 'admin'."""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Token de acesso ausente.")
+    token = authorization.split(" ", 1)[1]
+    try:
+        user = supabase.auth.get_user(token).user
+        roles = supabase.table("user_roles").select("role").eq("user_id", user.id).eq("role", "admin").limit(1).execute()
+    except Exception as e:
+        print(f"LOG (Python): Falha ao validar token de admin: {e}")
+        raise HTTPException(status_code=401, detail="Token de acesso inválido.")
+    if not roles.data:
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores.")
+    return user.id
+
+def validar_data_iso(valor: Optional[str], campo: str) -> Optional[str]:
+    if valor is None: return None
+    try:
+        datetime.fromisoformat(valor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Parâmetro '{campo}' deve estar no formato ISO 8601.")
+    return valor
+
 # === FUNÇÕES DE LÓGICA ===
 
+def assinar_session_id(base: str) -> str:
+    assinatura = hmac.new(SESSION_ID_SECRET.encode("utf-8"), base.encode("utf-8"), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(assinatura).decode("ascii").rstrip("=")
+
+def session_id_valido(session_id: Optional[str]) -> bool:
+    """Só aceita IDs emitidos por este servidor ("<uuid>.<assinatura>")."""
+    if not isinstance(session_id, str) or "." not in session_id:
+        return False
+    base, assinatura = session_id.split(".", 1)
+    try:
+        uuid.UUID(base)
+    except ValueError:
+        return False
+    return hmac.compare_digest(assinatura, assinar_session_id(base))
+
+def garantir_session_id(session: SessaoChat) -> str:
+    """
+    Atribui um ID de conversa assinado pelo servidor se o cliente não enviou um válido.
+    O cliente não consegue escolher nem forjar um ID para escrever na conversa de outra pessoa.
+    """
+    if not session_id_valido(session.session_id):
+        base = str(uuid.uuid4())
+        session.session_id = f"{base}.{assinar_session_id(base)}"
+        print(f"LOG (Python): Nova conversa iniciada. session_id={session.session_id}")
+    return session.session_id
+
 def detectar_tipo_e_palavras_chave(termo_busca_ia: str) -> Tuple[str, List[str]]:
     termo_lower = termo_busca_ia.lower()
     tipo_query = None
@@ -202,6 +508,77 @@ def detectar_tipo_e_palavras_chave(termo_busca_ia: str) -> Tuple[str, List[str]]
     if not palavras_chave and termo_limpo: palavras_chave = [termo_limpo]
     return tipo_query, palavras_chave
 
+# === LEITURA DA RESPOSTA DA IA ===
+ACAO_NENHUMA, ACAO_BUSCAR, ACAO_NAVEGAR = "nenhuma", "buscar", "navegar"
+ACOES_IA = {ACAO_NENHUMA, ACAO_BUSCAR, ACAO_NAVEGAR}
+RESPOSTA_VAZAMENTO = "Desculpe, me confundi. Pode repetir?"
+
+# Fallback (resposta em texto livre): regex lineares, sem backtracking no texto todo
+REGEX_TAG_NAVEGAR = re.compile(r"\[NAVEGAR_PARA\]", re.IGNORECASE)
+# O termo fica na mesma linha da tag ou na próxima linha não vazia (\s* pula as quebras).
+# [^\n]* sempre casa, então não há backtracking.
+REGEX_TAG_BUSCA = re.compile(r"\[CURSO_BUSCA\]\s*([^\n]*)", re.IGNORECASE)
+
+class RespostaIA:
+    __slots__ = ("texto", "acao", "termo_busca", "estruturada", "vazou_perfil")
+
+    def __init__(self, texto: str, acao: str = ACAO_NENHUMA, termo_busca: str = "", estruturada: bool = False):
+        self.vazou_perfil = "PERFIL DO CLIENTE" in texto
+        self.texto = RESPOSTA_VAZAMENTO if self.vazou_perfil else texto.strip()
+        self.termo_busca = termo_busca.strip()
+        # Busca sem termo não tem o que buscar
+        self.acao = ACAO_NENHUMA if acao == ACAO_BUSCAR and not self.termo_busca else acao
+        self.estruturada = estruturada
+
+def remover_cerca_codigo(texto: str) -> str:
+    """Tira a cerca de markdown (```json ... ```) que às vezes envolve o JSON."""
+    texto = texto.strip()
+    if not texto.startswith("```"):
+        return texto
+    quebra = texto.find("\n")
+    texto = texto[quebra + 1:] if quebra != -1 else texto[3:]
+    if texto.rstrip().endswith("```"):
+        texto = texto.rstrip()[:-3]
+    return texto.strip()
+
+def ler_tags(texto: str) -> Optional[Tuple[str, str, str]]:
+    """Procura [NAVEGAR_PARA] / [CURSO_BUSCA] no texto -> (texto antes da tag, ação, termo), ou None."""
+    match_nav = REGEX_TAG_NAVEGAR.search(texto)
+    if match_nav:
+        return texto[:match_nav.start()], ACAO_NAVEGAR, ""
+    match_busca = REGEX_TAG_BUSCA.search(texto)
+    if match_busca:
+        return texto[:match_busca.start()], ACAO_BUSCAR, match_busca.group(1).strip(" *#`\"'.")
+    return None
+
+def interpretar_resposta_ia(resposta_bruta: str) -> RespostaIA:
+    """
+    Lê a resposta do Gemini: o JSON de SCHEMA_RESPOSTA_IA (caminho normal, com ou sem cerca
+    de markdown) ou, se o modelo não devolver JSON válido, as tags [NAVEGAR_PARA] /
+    [CURSO_BUSCA] no texto livre.
+    """
+    try:
+        dados = json_loads(remover_cerca_codigo(resposta_bruta))
+        if isinstance(dados, dict) and isinstance(dados.get("resposta"), str) and dados.get("acao") in ACOES_IA:
+            texto, acao = dados["resposta"], dados["acao"]
+            termo = dados.get("termo_busca") if isinstance(dados.get("termo_busca"), str) else ""
+            # Prompts antigos (ex: módulos no Supabase) ainda pedem as tags: se vierem dentro
+            # de "resposta", a tag vale como ação e sai do texto mostrado ao cliente
+            tags = ler_tags(texto)
+            if tags:
+                texto, acao_tag, termo_tag = tags
+                if acao == ACAO_NENHUMA:
+                    acao = acao_tag
+                termo = termo or termo_tag
+            return RespostaIA(texto, acao, termo, estruturada=True)
+    except ValueError:
+        pass
+
+    tags = ler_tags(resposta_bruta)
+    if tags:
+        return RespostaIA(*tags)
+    return RespostaIA(resposta_bruta)
+
 def buscar_cursos_relevantes(termo_busca_ia: str, area_preferencial: str = None) -> list:
     global supabase
     tipo_curso, palavras_chave = detectar_tipo_e_palavras_chave(termo_busca_ia)
@@ -224,7 +601,8 @@ def buscar_cursos_relevantes(termo_busca_ia: str, area_preferencial: str = None)
             for palavra in palavras_chave:
                 query = query.ilike('"Nome dos cursos"', f"%{palavra}%")
             
-            response = query.execute()
+            with etapa("db"):
+                response = query.execute()
             if response.data:
                 resultados.extend(response.data)
 
@@ -234,7 +612,8 @@ def buscar_cursos_relevantes(termo_busca_ia: str, area_preferencial: str = None)
             for palavra in palavras_chave:
                 query = query.ilike('"Nome dos cursos"', f"%{palavra}%")
             
-            response = query.execute()
+            with etapa("db"):
+                response = query.execute()
             if response.data:
                 resultados.extend(response.data)
         
@@ -259,7 +638,8 @@ def buscar_curso_por_nome_exato(nome_curso: str, completo: bool = False) -> Opti
         else:
             select_cols = "id"
 
-        response = supabase.table("cursos").select(select_cols).eq('"Nome dos cursos"', nome_curso).limit(1).single().execute()
+        with etapa("db"):
+            response = supabase.table("cursos").select(select_cols).eq('"Nome dos cursos"', nome_curso).limit(1).single().execute()
         if response.data:
             return response.data
     except Exception as e:
@@ -326,11 +706,11 @@ def montar_resposta_dividida(curso: dict, nome_cliente: str, resumido: bool = Fa
     """
     return resposta_gancho, dados_para_contexto, pergunta_fechamento
 
-def atualizar_dados_cliente(session: ChatSession, mensagem_usuario: str, historico_recente_bot: list) -> bool:
+def atualizar_dados_cliente(session: SessaoChat, mensagem_usuario: str, ultima_msg_bot: Optional[MensagemHistorico]) -> bool:
     msg_lower = mensagem_usuario.lower()
     last_bot_msg = ""
-    if historico_recente_bot:
-        last_bot_msg = str(historico_recente_bot[-1].content).lower()
+    if ultima_msg_bot:
+        last_bot_msg = ultima_msg_bot.content.lower()
         
     etiqueta_atualizada = False
     
@@ -387,24 +767,30 @@ def atualizar_dados_cliente(session: ChatSession, mensagem_usuario: str, histori
 
 
 # === FUNÇÃO PRINCIPAL ===
-def gerar_resposta_usuario(mensagem: str, session: ChatSession) -> Tuple[str, ChatSession, Optional[str]]:
-    global PROMPTS_CARREGADOS, model, configuracao_geracao
+def gerar_resposta_usuario(mensagem: str, session: SessaoChat) -> Tuple[str, SessaoChat, Optional[str]]:
+    global PROMPTS_CARREGADOS, roteador_modelos
     
     navegar_para_link = None
     dados_do_contexto = None 
     curso_selecionado_via_numero = None
-    
+    curso_contexto_obj = None
+    etiqueta_atualizada = False
+    chave_cache = None
+
+    # Toda conversa é gravada sob um ID próprio (não mais sob o nome do cliente)
+    garantir_session_id(session)
+
     if not PROMPTS_CARREGADOS:
         print("LOG (Python): Prompts não carregados. Tentando carregar agora...")
         sucesso = carregar_prompts_do_supabase()
         if not sucesso:
              resposta_erro = "Desculpe, meu cérebro (IA) está offline."
-             session.historico.append(ChatMessage(role="assistant", content=resposta_erro))
+             session.historico.append("assistant", resposta_erro)
              return resposta_erro, session, None
 
     # SALVAR MSG USUARIO (O Python fará isso se não for a mensagem inicial)
     if mensagem != "...iniciar...":
-        salvar_mensagem(session.nome_cliente, "user", mensagem)
+        salvar_mensagem(session.session_id, "user", mensagem, ramo="mensagem_usuario", curso_contexto=session.curso_contexto)
     
     msg_lower = mensagem.lower()
     
@@ -422,8 +808,8 @@ Claro, {nome_cliente_local}! A carga horária total para o curso de **{session.c
 
 Mais alguma dúvida sobre os detalhes acadêmicos? Caso contrário, podemos falar sobre os valores de investimento! 😉
 """
-            session.historico.append(ChatMessage(role="assistant", content=resposta_cargahoraria))
-            salvar_mensagem(session.nome_cliente, "assistant", resposta_cargahoraria)
+            session.historico.append("assistant", resposta_cargahoraria)
+            salvar_mensagem(session.session_id, "assistant", resposta_cargahoraria, ramo="bypass_carga_horaria", curso_contexto=session.curso_contexto)
             print(f"LOG (Python): Resposta forçada de Carga Horária: {carga_horaria_txt}")
             return resposta_cargahoraria, session, None
 
@@ -450,8 +836,8 @@ Para o curso de **{session.curso_contexto}**, os requisitos de conclusão são:
 
 Com isso, você já tem certeza dos requisitos acadêmicos. Quer que eu te envie os **valores de investimento** agora? 😉
 """
-            session.historico.append(ChatMessage(role="assistant", content=resposta_artigo_estagio))
-            salvar_mensagem(session.nome_cliente, "assistant", resposta_artigo_estagio)
+            session.historico.append("assistant", resposta_artigo_estagio)
+            salvar_mensagem(session.session_id, "assistant", resposta_artigo_estagio, ramo="bypass_artigo_estagio", curso_contexto=session.curso_contexto)
             print("LOG (Python): Resposta forçada de Requisitos (Artigo/Estágio).")
             return resposta_artigo_estagio, session, None
             
@@ -471,8 +857,8 @@ Você pode acessar a ementa completa do curso de **{session.curso_contexto}** po
 
 Dê uma olhadinha com calma e me diga o que achou, combinado?
 """
-            session.historico.append(ChatMessage(role="assistant", content=resposta_ementa))
-            salvar_mensagem(session.nome_cliente, "assistant", resposta_ementa)
+            session.historico.append("assistant", resposta_ementa)
+            salvar_mensagem(session.session_id, "assistant", resposta_ementa, ramo="bypass_ementa", curso_contexto=session.curso_contexto)
             print("LOG (Python): Resposta forçada de Ementa/Grade.")
             return resposta_ementa, session, None
 
@@ -535,17 +921,17 @@ Isso se alinha com o que você imaginava para o curso?
 """
                         
                         # 4. Atualiza o histórico (HIDDEN e a resposta)
-                        session.historico.append(ChatMessage(role="assistant", content=f"HIDDEN:{dados_ocultos}"))
-                        session.historico.append(ChatMessage(role="assistant", content=resposta_detalhada_python))
-                        salvar_mensagem(session.nome_cliente, "assistant", resposta_detalhada_python)
+                        session.historico.append("assistant", f"HIDDEN:{dados_ocultos}")
+                        session.historico.append("assistant", resposta_detalhada_python)
+                        salvar_mensagem(session.session_id, "assistant", resposta_detalhada_python, ramo="bypass_selecao_numerica", curso_contexto=session.curso_contexto)
                         print("LOG (Python): Resposta forçada após seleção numérica. Bypassing Gemini call.")
 
                         return resposta_detalhada_python, session, None
                     else:
                          # Se o curso não for achado (DB ou nome errado), damos uma mensagem de erro controlada.
                          resposta_erro_bypass = f"Ops, {session.nome_cliente}. Não consegui carregar os detalhes do curso que você digitou. Por favor, tente digitar o nome completo do curso ou selecione outra opção."
-                         session.historico.append(ChatMessage(role="assistant", content=resposta_erro_bypass))
-                         salvar_mensagem(session.nome_cliente, "system_error", resposta_erro_bypass)
+                         session.historico.append("assistant", resposta_erro_bypass)
+                         salvar_mensagem(session.session_id, "system_error", resposta_erro_bypass, ramo="erro_selecao_numerica", curso_contexto=session.curso_contexto)
                          return resposta_erro_bypass, session, None
 
             # Se a opção numérica existir, mas o curso não for encontrado (else/except), cairemos aqui
@@ -555,8 +941,8 @@ Isso se alinha com o que você imaginava para o curso?
             # Em caso de erro de REGEX ou INT, informamos o usuário.
             print(f"!!! CRITICAL BYPASS ERROR: {e}") 
             resposta_erro_critico = f"Desculpe, {session.nome_cliente}. Ocorreu um erro interno ao processar sua escolha numérica. Por favor, tente novamente ou digite o nome completo do curso."
-            session.historico.append(ChatMessage(role="assistant", content=resposta_erro_critico))
-            salvar_mensagem(session.nome_cliente, "system_error", resposta_erro_critico)
+            session.historico.append("assistant", resposta_erro_critico)
+            salvar_mensagem(session.session_id, "system_error", resposta_erro_critico, ramo="erro_selecao_numerica", curso_contexto=session.curso_contexto)
             return resposta_erro_critico, session, None
 
     # =========================================================================
@@ -566,12 +952,13 @@ Isso se alinha com o que você imaginava para o curso?
         mensagem = f"Quero saber mais sobre o curso {curso_selecionado_via_numero}"
 
 
-    historico_recente_bot = [msg for msg in session.historico if msg.role == "assistant"]
+    ultima_msg_bot = session.historico.ultima_do_bot()
     
     if session.curso_contexto:
         print(f"LOG (Python): Contexto ativo: {session.curso_contexto}. Atualizando dados...")
         curso_obj = buscar_curso_por_nome_exato(session.curso_contexto, completo=True)
         if curso_obj:
+            curso_contexto_obj = curso_obj
             _, dados_ocultos, _ = montar_resposta_dividida(curso_obj, session.nome_cliente)
             dados_do_contexto = dados_ocultos
         else:
@@ -580,13 +967,36 @@ Isso se alinha com o que você imaginava para o curso?
 
     if mensagem != "...iniciar...":
         # ATUALIZA AS ETIQUETAS COM BASE NA ÚLTIMA MENSAGEM DO USUÁRIO
-        atualizar_dados_cliente(session, mensagem, historico_recente_bot)
+        etiqueta_atualizada = atualizar_dados_cliente(session, mensagem, ultima_msg_bot)
         # Adiciona a mensagem re-escrita ou original ao histórico da sessão
-        session.historico.append(ChatMessage(role="user", content=mensagem))
+        session.historico.append("user", mensagem)
     
     nome_cliente_local = session.nome_cliente
 
-    perfil_cliente_prompt = f"""
+    # === CACHE DE RESPOSTAS (mesmo curso + mesma pergunta + mesmo perfil, entre visitantes) ===
+    # Só para perguntas autocontidas sobre o curso em contexto; se a mensagem mudou o perfil
+    # do cliente, a resposta depende dele e não é reaproveitada. O perfil (formação, tipo,
+    # área) entra na chave: as regras de elegibilidade do prompt respondem a partir dele.
+    if curso_contexto_obj and not etiqueta_atualizada and mensagem != "...iniciar...":
+        pergunta_normalizada = normalizar_pergunta(mensagem)
+        if pergunta_normalizada:
+            chave_cache = (
+                str(curso_contexto_obj.get('id')),
+                pergunta_normalizada,
+                tuple((getattr(session, campo) or "").strip().lower() for campo in CAMPOS_PERFIL_CACHE),
+                f"{VERSAO_TEMPLATE_PROMPT}:{VERSAO_PROMPTS}",
+                versao_de(curso_contexto_obj),
+            )
+            template = cache_respostas.buscar(chave_cache, session.curso_contexto)
+            if template:
+                print(f"LOG (Python): Resposta em cache para '{pergunta_normalizada}'. Bypassing Gemini call.")
+                resposta_cache = personalizar(template, session.nome_cliente)
+                session.historico.append("assistant", resposta_cache)
+                salvar_mensagem(session.session_id, "assistant", resposta_cache, ramo="cache_resposta", curso_contexto=session.curso_contexto)
+                return resposta_cache, session, None
+
+    with etapa("prompt"):
+        perfil_cliente_prompt = f"""
 ---
 🧠 **PERFIL DO CLIENTE (Etiquetas Obrigatórias)**
 - **Nome:** {session.nome_cliente}
@@ -596,23 +1006,19 @@ Isso se alinha com o que você imaginava para o curso?
 - **Contexto de Página (Curso):** {session.curso_contexto if session.curso_contexto else 'Nenhum'}
 ---
 """
-    
-    if not dados_do_contexto:
-        for msg in reversed(session.historico):
-             if "[DADOS_CURSO_ENCONTRADO:" in msg.content:
-                  content_clean = msg.content.replace("HIDDEN:", "")
-                  dados_do_contexto = content_clean
-                  break
-    
-    prompt_sistema_completo = montar_prompt_base(perfil_cliente_prompt, dados_do_contexto)
-    
-    historico_limpo_str = ""
-    for msg in session.historico[-10:]:
-        if not msg.content.startswith("HIDDEN:") and not msg.content.startswith("[DADOS_CURSO_ENCONTRADO:"):
-            role_str = "Bot" if msg.role in ["bot", "assistant"] else "Usuário"
-            historico_limpo_str += f"{role_str}: {msg.content}\n"
+        
+        if not dados_do_contexto:
+            # Índice mantido pelo HistoricoCompacto (sem reescanear o histórico)
+            dados_do_contexto = session.historico.ultimos_dados_curso()
+        
+        prompt_sistema_completo = montar_prompt_base(perfil_cliente_prompt, dados_do_contexto)
+        
+        historico_limpo_str = "".join(
+            f"{'Bot' if msg.role in ('bot', 'assistant') else 'Usuário'}: {msg.content}\n"
+            for msg in session.historico.visiveis_recentes(10)
+        )
 
-    prompt_final = f"""
+        prompt_final = f"""
 {prompt_sistema_completo}
 
 Histórico recente da conversa:
@@ -621,26 +1027,32 @@ Histórico recente da conversa:
 Nova mensagem do usuário: "{mensagem}"
 
 OBSERVAÇÃO: Se o histórico mostrar uma lista numerada e o usuário tiver escolhido uma opção, assuma que o curso escolhido é o foco agora e use os dados dele.
+
+FORMATO DA RESPOSTA (OBRIGATÓRIO): responda APENAS com um objeto JSON com os campos:
+- "resposta": o texto para o cliente, sem tags de controle (como [NAVEGAR_PARA] ou [CURSO_BUSCA]).
+- "acao": "navegar" para levar o cliente à página do curso (regra 8); "buscar" para procurar um curso (regras 9 e 10); senão "nenhuma".
+- "termo_busca": quando "acao" for "buscar", o NOME DO CURSO (ex: "2ª Licenciatura em Pedagogia"); senão "".
 """
 
     try:
-        if not model: raise Exception("Cliente Gemini não foi inicializado.")
+        if not roteador_modelos: raise Exception("Cliente Gemini não foi inicializado.")
              
         print(f"LOG (Python): Gerando conteúdo no Gemini para: {mensagem}")
-        interpretacao = model.generate_content(prompt_final, generation_config=configuracao_geracao)
-        resposta_bruta = interpretacao.text.strip()
-        
-        if "PERFIL DO CLIENTE" in resposta_bruta:
-            resposta_ia_conversacional = "Desculpe, me confundi. Pode repetir?"
-        else:
-            resposta_ia_conversacional = resposta_bruta
+        with etapa("geracao"):
+            nivel = classificar_turno(mensagem, len(session.historico), dados_do_contexto is not None)
+            interpretacao, nivel_usado = roteador_modelos.gerar(nivel, prompt_final)
+            resposta_bruta = interpretacao.text.strip()
+        print(f"LOG (Python): Resposta gerada pelo nível '{nivel_usado}' (pedido: '{nivel}').")
         
-        match_nav = re.search(r"\[NAVEGAR_PARA\]", resposta_bruta, re.IGNORECASE)
-        match_busca = re.search(r"\[CURSO_BUSCA\]\s*(.*)\b([a-zA-Z\s\-áéíóúâêôãõç]{5,}[a-zA-Záéíóúâêôãõç])\s*$", resposta_bruta, re.IGNORECASE | re.DOTALL)
-
-        if match_nav:
-            print("LOG (Python): IA solicitou [NAVEGAR_PARA]")
-            resposta_ia_conversacional = resposta_bruta.split(match_nav.group(0))[0].strip()
+        with etapa("parse"):
+            resposta_ia = interpretar_resposta_ia(resposta_bruta)
+        if not resposta_ia.estruturada:
+            print("LOG (Python): Resposta fora do JSON esperado. Usando leitura das tags (fallback).")
+        resposta_ia_conversacional = resposta_ia.texto
+
+        ramo_busca = None  # Ramo das buscas que não listaram cursos (vazia com contexto / redundante)
+        if resposta_ia.acao == ACAO_NAVEGAR:
+            print("LOG (Python): IA solicitou navegação")
             
             curso_para_navegar = session.curso_contexto
             if not curso_para_navegar and dados_do_contexto:
@@ -656,18 +1068,16 @@ OBSERVAÇÃO: Se o histórico mostrar uma lista numerada e o usuário tiver esco
             else:
                  print("!!! ERRO (Python): IA pediu para navegar mas não achou curso.")
             
-            salvar_mensagem(session.nome_cliente, "assistant", resposta_ia_conversacional)
-
-        elif match_busca: 
-            print("LOG (Python): IA solicitou [CURSO_BUSCA]")
-            resposta_ia_conversacional = resposta_bruta.split(match_busca.group(0))[0].strip()
-            termo_principal = match_busca.group(2).strip()
+        elif resposta_ia.acao == ACAO_BUSCAR:
+            print(f"LOG (Python): IA solicitou busca por: {resposta_ia.termo_busca}")
+            termo_principal = resposta_ia.termo_busca
             
             # === BLINDAGEM DE CONTEXTO ===
             # Se já temos contexto e a busca é redundante, ignoramos
             if session.curso_contexto and termo_principal.lower() in session.curso_contexto.lower():
                  print("LOG (Python): Busca redundante. Mantendo contexto.")
                  cursos_encontrados_raw = []
+                 ramo_busca = "llm_busca_redundante"
             else:
                  cursos_encontrados_raw = buscar_cursos_relevantes(termo_principal, session.area_preferencial)
             # =============================
@@ -676,13 +1086,18 @@ OBSERVAÇÃO: Se o histórico mostrar uma lista numerada e o usuário tiver esco
                 # Se tivermos objetos completos (do force search), não precisamos re-buscar por ID
                 if 'Nome dos cursos' not in cursos_encontrados_raw[0]: 
                     ids_cursos = [c['id'] for c in cursos_encontrados_raw]
-                    resp_completos = supabase.table("cursos").select("*").in_("id", ids_cursos).execute()
+                    with etapa("db"):
+                        resp_completos = supabase.table("cursos").select("*").in_("id", ids_cursos).execute()
                     cursos_encontrados_raw = resp_completos.data or []
 
+            if not cursos_encontrados_raw and not ramo_busca:
+                # Nada encontrado, mas o curso em contexto continua valendo: segue a conversa
+                ramo_busca = "llm_busca_vazia_contexto"
+
             if not cursos_encontrados_raw and not session.curso_contexto:
                 resposta_falha = resposta_ia_conversacional + f"\n\nOps, {nome_cliente_local}. Não encontrei cursos com esse nome."
-                session.historico.append(ChatMessage(role="assistant", content=resposta_falha))
-                salvar_mensagem(session.nome_cliente, "assistant", resposta_falha)
+                session.historico.append("assistant", resposta_falha)
+                salvar_mensagem(session.session_id, "assistant", resposta_falha, ramo="llm_busca_vazia", curso_contexto=session.curso_contexto)
                 return resposta_falha, session, None
             
             if len(cursos_encontrados_raw) == 1:
@@ -692,12 +1107,12 @@ OBSERVAÇÃO: Se o histórico mostrar uma lista numerada e o usuário tiver esco
                 
                 gancho, dados_ocultos, pergunta = montar_resposta_dividida(curso, nome_cliente_local, resumido=False)
                 
-                session.historico.append(ChatMessage(role="assistant", content=f"HIDDEN:{dados_ocultos}"))
+                session.historico.append("assistant", f"HIDDEN:{dados_ocultos}")
                 
                 resposta_final = f"{resposta_ia_conversacional}\n\n{gancho}\n\n{pergunta}"
-                session.historico.append(ChatMessage(role="assistant", content=resposta_final))
+                session.historico.append("assistant", resposta_final)
                 
-                salvar_mensagem(session.nome_cliente, "assistant", resposta_final)
+                salvar_mensagem(session.session_id, "assistant", resposta_final, ramo="llm_busca_unica", curso_contexto=session.curso_contexto)
                 return resposta_final, session, None
 
             if len(cursos_encontrados_raw) > 1:
@@ -710,28 +1125,68 @@ OBSERVAÇÃO: Se o histórico mostrar uma lista numerada e o usuário tiver esco
                 
                 resposta_final += "\n\nPor favor, digite o **número** da opção que deseja conhecer melhor (ex: 1)."
                 
-                session.historico.append(ChatMessage(role="assistant", content=resposta_final))
-                salvar_mensagem(session.nome_cliente, "assistant", resposta_final)
+                session.historico.append("assistant", resposta_final)
+                salvar_mensagem(session.session_id, "assistant", resposta_final, ramo="llm_busca_lista", curso_contexto=session.curso_contexto)
                 return resposta_final, session, None
                         
         print("LOG (Python): Resposta conversacional normal.")
-        session.historico.append(ChatMessage(role="assistant", content=resposta_ia_conversacional))
-        salvar_mensagem(session.nome_cliente, "assistant", resposta_ia_conversacional)
+        if chave_cache and resposta_ia.acao == ACAO_NENHUMA and not resposta_ia.vazou_perfil:
+            cache_respostas.guardar(chave_cache, para_template(resposta_ia_conversacional, session.nome_cliente))
+        session.historico.append("assistant", resposta_ia_conversacional)
+        ramo_final = ramo_busca or ("llm_navegacao" if resposta_ia.acao == ACAO_NAVEGAR else "llm_conversa")
+        salvar_mensagem(session.session_id, "assistant", resposta_ia_conversacional, ramo=ramo_final, curso_contexto=session.curso_contexto, navegar_para=navegar_para_link)
         return resposta_ia_conversacional, session, navegar_para_link
 
     except Exception as e:
         print(f"LOG (Python) ERRO GEMINI: {e}")
         resposta_erro = f"Ocorreu um erro ao gerar a resposta. [LOG INTERNO: {e}]"
-        session.historico.append(ChatMessage(role="assistant", content=resposta_erro))
-        salvar_mensagem(session.nome_cliente, "system_error", str(e))
+        session.historico.append("assistant", resposta_erro)
+        salvar_mensagem(session.session_id, "system_error", str(e), ramo="erro_llm", curso_contexto=session.curso_contexto)
         return resposta_erro, session, None
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+# O corpo do /chat é decodificado direto para SessaoChat (chat_historico.py), sem montar
+# os modelos pydantic; eles seguem documentando o mesmo contrato no OpenAPI.
+SCHEMA_CHAT_REQUEST = ChatRequest.model_json_schema(ref_template="#/components/schemas/{model}")
+SCHEMA_CHAT_REQUEST.pop("$defs", None)
+
+def erros_validacao_chat(corpo: bytes, erro: ValueError) -> List[Dict]:
+    """
+    Erros no mesmo formato da validação do FastAPI (lista com type/loc/msg), como antes da
+    decodificação compacta. Só roda para payloads inválidos: os modelos pydantic refazem a
+    validação para montar a lista.
+    """
+    try:
+        ChatRequest.model_validate_json(corpo)
+    except ValidationError as e:
+        return [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+    return [{"type": "value_error", "loc": ("body",), "msg": str(erro), "input": None}]
+
+@app.post(
+    "/chat",
+    response_model=ChatResponse,
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": SCHEMA_CHAT_REQUEST}}}},
+    responses={422: {
+        "description": "Validation Error",
+        "content": {"application/json": {"schema": {"$ref": "#/components/schemas/HTTPValidationError"}}},
+    }},
+)
+async def chat_endpoint(request: Request):
     print(f"\n--- LOG (Python) API: Nova Requisição Recebida ---")
+    corpo = await request.body()
     try:
-        resposta_bot, session_atualizada, navegar_para = gerar_resposta_usuario(request.mensagem, request.session)
+        mensagem, session = decodificar_requisicao_chat(corpo)
+    except ValueError as e:
+        raise RequestValidationError(erros_validacao_chat(corpo, e), body=corpo)
+
+    impressao = impressao_digital(corpo)
+    # O hash do corpo só vale como chave dentro de uma conversa já existente (session_id válido)
+    session_id_conhecido = session.session_id if session_id_valido(session.session_id) else None
+    chave = montar_chave(request.headers.get("idempotency-key"), session_id_conhecido, impressao)
+
+    async def processar() -> bytes:
+        # gerar_resposta_usuario é bloqueante (Supabase/Gemini): roda fora do event loop
+        resposta_bot, session_atualizada, navegar_para = await run_in_threadpool(gerar_resposta_usuario, mensagem, session)
         # NOVO LOG PARA ACOMPANHAR A SESSÃO ATUALIZADA
         print(
             "LOG (ChatProvider) SESSÃO ATUALIZADA:", 
@@ -741,15 +1196,112 @@ async def chat_endpoint(request: ChatRequest):
                 "formacao": session_atualizada.formacao_cliente,
             })
         )
-        return ChatResponse(
-            resposta_bot=resposta_bot,
-            session_atualizada=session_atualizada,
-            navegar_para=navegar_para
-        )
+        await run_in_threadpool(salvar_perfil_sessao, session_atualizada)
+        return codificar_resposta_chat(resposta_bot, session_atualizada, navegar_para)
+
+    try:
+        # Rastreio por etapa só quando o cliente pede (header X-Trace-Etapas: 1)
+        with rastrear(request.headers.get(HEADER_RASTREIO) == "1") as rastreio:
+            conteudo, reaproveitado = await idempotencia_chat.executar(chave, impressao, session_id_conhecido, processar)
+
+        headers = {}
+        if reaproveitado:
+            print("LOG (Python): Requisição duplicada. Reaproveitando a resposta da execução original.")
+            headers["Idempotent-Replayed"] = "true"
+        if rastreio:
+            headers["Server-Timing"] = rastreio.server_timing()
+        return Response(content=conteudo, media_type="application/json", headers=headers)
+    except ConflitoIdempotencia:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já usada com outro conteúdo.")
     except Exception as e:
         print(f"!!! ERRO FATAL (Python) Desconhecido: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {e}")
 
+@app.get("/historico/{session_id}", response_model=HistoricoResponse)
+def historico_endpoint(
+    session_id: str,
+    limite: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+):
+    if not session_id_valido(session_id):
+        raise HTTPException(status_code=400, detail="session_id inválido.")
+    perfil = None
+    try:
+        mensagens, proximo_cursor = buscar_historico_sessao(session_id, limite, cursor)
+        if cursor is None:
+            # Perfil para o widget retomar a conversa com nome, formação e curso
+            perfil = buscar_perfil_sessao(session_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    except Exception as e:
+        print(f"!!! ERRO (Python) ao buscar histórico: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno: {e}")
+    return HistoricoResponse(session_id=session_id, mensagens=mensagens, proximo_cursor=proximo_cursor, perfil=perfil)
+
+@app.get("/admin/chat-export")
+def chat_export_endpoint(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    desde: Optional[str] = None,
+    ate: Optional[str] = None,
+    _admin: str = Depends(verificar_admin),
+):
+    linhas = iterar_mensagens_exportacao(validar_data_iso(desde, "desde"), validar_data_iso(ate, "ate"))
+    if formato == "csv":
+        corpo, media_type = formatar_csv(linhas), "text/csv; charset=utf-8"
+    else:
+        corpo, media_type = formatar_ndjson(linhas), "application/x-ndjson"
+    return StreamingResponse(
+        corpo,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="chat_messages.{formato}"'},
+    )
+
+@app.get("/admin/chat-rollups")
+def chat_rollups_endpoint(
+    desde: Optional[str] = None,
+    ate: Optional[str] = None,
+    _admin: str = Depends(verificar_admin),
+):
+    try:
+        return buscar_rollups_chat(validar_data_iso(desde, "desde"), validar_data_iso(ate, "ate"))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"!!! ERRO (Python) ao buscar rollups: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno: {e}")
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+def profile_endpoint(
+    segundos: float = Query(10, gt=0, le=60),
+    modo: str = Query("wall", pattern="^(cpu|wall)$"),
+    intervalo_ms: float = Query(10, ge=1, le=1000),
+    _admin: str = Depends(verificar_admin),
+):
+    """Perfil amostrado do processo em formato folded (flamegraph.pl / speedscope)."""
+    print(f"LOG (Python): Capturando perfil '{modo}' por {segundos}s...")
+    try:
+        perfil = capturar_perfil(segundos, modo, intervalo_ms / 1000)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if perfil is None:
+        raise HTTPException(status_code=409, detail="Já existe um perfil em andamento.")
+    return PlainTextResponse(
+        perfil,
+        headers={"Content-Disposition": f'attachment; filename="perfil_{modo}.folded"'},
+    )
+
+@app.get("/admin/cache-respostas")
+def cache_respostas_endpoint(_admin: str = Depends(verificar_admin)):
+    """Taxa de acerto do cache de respostas, por curso."""
+    return cache_respostas.relatorio()
+
+@app.get("/admin/roteador-modelos")
+def roteador_modelos_endpoint(_admin: str = Depends(verificar_admin)):
+    """Custo e latência por nível de modelo."""
+    if not roteador_modelos:
+        raise HTTPException(status_code=503, detail="Cliente Gemini não foi inicializado.")
+    return roteador_modelos.relatorio()
+
 @app.post("/refresh-prompts", status_code=200)
 async def refresh_prompts():
     sucesso = carregar_prompts_do_supabase()
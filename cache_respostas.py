@@ -0,0 +1,119 @@
+"""
+Cache de respostas do Gemini compartilhado entre visitantes (usado pelo bot_api.py).
+
+Perguntas frequentes sobre o mesmo curso ("quanto custa no pix?", "é reconhecido pelo MEC?")
+recebem a mesma resposta. A chave é (id do curso, pergunta normalizada, perfil do cliente,
+versão dos prompts, versão do cadastro do curso): clientes com formações diferentes não
+compartilham respostas ("posso fazer esse curso?"). Quando o registro em 'cursos' ou os
+prompts mudam, a versão muda e as entradas antigas deixam de ser encontradas (e saem por LRU/TTL).
+O nome do cliente é trocado por um marcador ao guardar e recolocado ao servir.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+TTL_RESPOSTAS_S = 6 * 60 * 60
+MAX_RESPOSTAS = 2000
+MARCADOR_NOME = "{{NOME_CLIENTE}}"
+
+# Palavras que não mudam o sentido da pergunta
+PALAVRAS_IRRELEVANTES = {"oi", "ola", "bom", "boa", "dia", "tarde", "noite", "por", "favor", "me", "diz", "diga", "fala", "ai", "entao", "so", "uma", "duvida"}
+# Só perguntas "autocontidas" entram no cache (respostas curtas como "sim" dependem do histórico)
+INICIOS_DE_PERGUNTA = {"quanto", "quantos", "quantas", "qual", "quais", "como", "tem", "e", "onde", "quando", "posso", "pode", "preciso", "aceita", "aceitam", "o", "existe", "precisa", "da", "faz"}
+MIN_PALAVRAS = 3
+MAX_PALAVRAS = 30
+
+
+def normalizar_pergunta(mensagem: str) -> Optional[str]:
+    """Forma canônica da pergunta, ou None se ela não for cacheável."""
+    texto = unicodedata.normalize("NFKD", mensagem.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    eh_pergunta = "?" in texto
+    palavras = [p for p in re.sub(r"[^\w\s]", " ", texto).split() if p not in PALAVRAS_IRRELEVANTES]
+    if not (MIN_PALAVRAS <= len(palavras) <= MAX_PALAVRAS):
+        return None
+    if not eh_pergunta and palavras[0] not in INICIOS_DE_PERGUNTA:
+        return None
+    return " ".join(palavras)
+
+
+def versao_de(obj) -> str:
+    """Hash estável de um dict/lista (ex: prompts carregados, registro do curso)."""
+    bruto = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(bruto).hexdigest()[:16]
+
+
+def para_template(resposta: str, nome_cliente: str) -> str:
+    if nome_cliente == "visitante":
+        return resposta
+    return re.sub(rf"\b{re.escape(nome_cliente)}\b", MARCADOR_NOME, resposta)
+
+
+def personalizar(template: str, nome_cliente: str) -> str:
+    if nome_cliente == "visitante":
+        # "Claro, {{NOME}}!" -> "Claro!"
+        return re.sub(rf",?\s*{re.escape(MARCADOR_NOME)}", "", template)
+    return template.replace(MARCADOR_NOME, nome_cliente)
+
+
+class CacheRespostas:
+    def __init__(self, ttl_s: float = TTL_RESPOSTAS_S, max_respostas: int = MAX_RESPOSTAS):
+        self.ttl_s = ttl_s
+        self.max_respostas = max_respostas
+        self._trava = threading.Lock()  # gerar_resposta_usuario roda no threadpool
+        # chave -> (expira_em, template)
+        self._respostas: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()
+        # id do curso -> {"curso", "acertos", "falhas"}
+        self._estatisticas: Dict[str, Dict] = {}
+
+    def _contar(self, curso_id: str, nome_curso: str, campo: str) -> None:
+        estat = self._estatisticas.setdefault(curso_id, {"curso": nome_curso, "acertos": 0, "falhas": 0})
+        estat[campo] += 1
+
+    def buscar(self, chave: Tuple, nome_curso: str) -> Optional[str]:
+        curso_id = chave[0]
+        with self._trava:
+            entrada = self._respostas.get(chave)
+            if entrada and entrada[0] > time.monotonic():
+                self._respostas.move_to_end(chave)
+                self._contar(curso_id, nome_curso, "acertos")
+                return entrada[1]
+            if entrada:
+                del self._respostas[chave]
+            self._contar(curso_id, nome_curso, "falhas")
+            return None
+
+    def guardar(self, chave: Tuple, template: str) -> None:
+        with self._trava:
+            self._respostas[chave] = (time.monotonic() + self.ttl_s, template)
+            self._respostas.move_to_end(chave)
+            while len(self._respostas) > self.max_respostas:
+                self._respostas.popitem(last=False)
+
+    def limpar(self) -> None:
+        with self._trava:
+            self._respostas.clear()
+
+    def relatorio(self) -> Dict:
+        """Taxa de acerto por curso (e geral)."""
+        with self._trava:
+            por_curso = {}
+            acertos = falhas = 0
+            for curso_id, estat in self._estatisticas.items():
+                total = estat["acertos"] + estat["falhas"]
+                por_curso[curso_id] = {**estat, "taxa_acerto": round(estat["acertos"] / total, 3) if total else 0.0}
+                acertos += estat["acertos"]
+                falhas += estat["falhas"]
+            total = acertos + falhas
+            return {
+                "entradas": len(self._respostas),
+                "acertos": acertos,
+                "falhas": falhas,
+                "taxa_acerto": round(acertos / total, 3) if total else 0.0,
+                "por_curso": por_curso,
+            }
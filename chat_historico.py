@@ -0,0 +1,196 @@
+"""
+Representação interna compacta da sessão de chat (usada pelo bot_api.py).
+
+O payload público (ChatRequest / ChatResponse) não muda: o JSON é decodificado direto
+para estas classes com __slots__, sem passar pela validação completa do pydantic, e
+codificado de volta no mesmo formato. Roles são internados e as mensagens HIDDEN /
+com bloco de dados do curso viram flags calculadas uma única vez na decodificação.
+"""
+import json
+import sys
+from typing import Any, Dict, Iterator, List, Optional
+
+# === CODEC JSON (orjson é opcional) ===
+try:
+    import orjson
+
+    def json_loads(dados: Any) -> Any:
+        return orjson.loads(dados)
+
+    def json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+except ImportError:
+    def json_loads(dados: Any) -> Any:
+        return json.loads(dados)
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# === ROLES E FLAGS ===
+ROLE_USER = sys.intern("user")
+ROLE_ASSISTANT = sys.intern("assistant")
+_ROLES_CONHECIDOS = {r: r for r in (ROLE_USER, ROLE_ASSISTANT, sys.intern("bot"), sys.intern("system_error"))}
+
+PREFIXO_OCULTO = "HIDDEN:"
+MARCADOR_DADOS_CURSO = "[DADOS_CURSO_ENCONTRADO:"
+
+FLAG_OCULTA = 1       # Começa com HIDDEN: ou com o bloco de dados -> fica fora do histórico do prompt
+FLAG_DADOS_CURSO = 2  # Contém um bloco [DADOS_CURSO_ENCONTRADO: ...]
+
+
+def internar_role(role: str) -> str:
+    # Só os roles conhecidos são internados (não internamos texto arbitrário do cliente)
+    return _ROLES_CONHECIDOS.get(role, role)
+
+
+def calcular_flags(content: str) -> int:
+    flags = 0
+    if content.startswith(PREFIXO_OCULTO) or content.startswith(MARCADOR_DADOS_CURSO):
+        flags |= FLAG_OCULTA
+    if MARCADOR_DADOS_CURSO in content:
+        flags |= FLAG_DADOS_CURSO
+    return flags
+
+
+class MensagemHistorico:
+    __slots__ = ("role", "content", "flags")
+
+    def __init__(self, role: str, content: str):
+        self.role = internar_role(role)
+        self.content = content
+        self.flags = calcular_flags(content)
+
+    @property
+    def oculta(self) -> bool:
+        return bool(self.flags & FLAG_OCULTA)
+
+
+class HistoricoCompacto:
+    """
+    Lista de mensagens que mantém, conforme cresce, o índice da última resposta do bot e
+    do último bloco de dados de curso (evita reescanear o histórico a cada turno).
+    """
+    __slots__ = ("mensagens", "idx_ultima_bot", "idx_dados_curso")
+
+    def __init__(self) -> None:
+        self.mensagens: List[MensagemHistorico] = []
+        self.idx_ultima_bot = -1
+        self.idx_dados_curso = -1
+
+    def append(self, role: str, content: str) -> MensagemHistorico:
+        msg = MensagemHistorico(role, content)
+        self.mensagens.append(msg)
+        indice = len(self.mensagens) - 1
+        if msg.role is ROLE_ASSISTANT:
+            self.idx_ultima_bot = indice
+        if msg.flags & FLAG_DADOS_CURSO:
+            self.idx_dados_curso = indice
+        return msg
+
+    def __len__(self) -> int:
+        return len(self.mensagens)
+
+    def __getitem__(self, indice: int) -> MensagemHistorico:
+        return self.mensagens[indice]
+
+    def __iter__(self) -> Iterator[MensagemHistorico]:
+        return iter(self.mensagens)
+
+    def ultima_do_bot(self) -> Optional[MensagemHistorico]:
+        return self.mensagens[self.idx_ultima_bot] if self.idx_ultima_bot >= 0 else None
+
+    def ultimos_dados_curso(self) -> Optional[str]:
+        """Conteúdo (sem o prefixo HIDDEN:) do bloco de dados de curso mais recente."""
+        if self.idx_dados_curso < 0:
+            return None
+        return self.mensagens[self.idx_dados_curso].content.replace(PREFIXO_OCULTO, "")
+
+    def visiveis_recentes(self, n: int) -> Iterator[MensagemHistorico]:
+        """Mensagens não ocultas dentre as últimas n."""
+        for msg in self.mensagens[-n:]:
+            if not msg.flags & FLAG_OCULTA:
+                yield msg
+
+    def para_lista(self) -> List[Dict[str, str]]:
+        return [{"role": m.role, "content": m.content} for m in self.mensagens]
+
+
+# === SESSÃO ===
+_CAMPOS_OPCIONAIS = ("formacao_cliente", "tipo_formacao", "area_preferencial", "curso_contexto", "session_id")
+
+
+class SessaoChat:
+    """Espelho interno de ChatSession (mesmos campos, mesmo formato no JSON)."""
+    __slots__ = ("session_id", "nome_cliente", "formacao_cliente", "tipo_formacao",
+                 "area_preferencial", "historico", "curso_contexto")
+
+    def __init__(self) -> None:
+        self.session_id: Optional[str] = None
+        self.nome_cliente = "visitante"
+        self.formacao_cliente: Optional[str] = None
+        self.tipo_formacao: Optional[str] = None
+        self.area_preferencial: Optional[str] = None
+        self.historico = HistoricoCompacto()
+        self.curso_contexto: Optional[str] = None
+
+    @classmethod
+    def de_dict(cls, dados: Any) -> "SessaoChat":
+        """Valida e converte o dicionário 'session' do payload. Levanta ValueError se inválido."""
+        if not isinstance(dados, dict):
+            raise ValueError("session deve ser um objeto")
+        sessao = cls()
+
+        nome = dados.get("nome_cliente", "visitante")
+        if not isinstance(nome, str):
+            raise ValueError("session.nome_cliente deve ser texto")
+        sessao.nome_cliente = nome
+
+        for campo in _CAMPOS_OPCIONAIS:
+            valor = dados.get(campo)
+            if valor is not None and not isinstance(valor, str):
+                raise ValueError(f"session.{campo} deve ser texto ou null")
+            setattr(sessao, campo, valor)
+
+        historico = dados.get("historico") or []
+        if not isinstance(historico, list):
+            raise ValueError("session.historico deve ser uma lista")
+        for item in historico:
+            if not isinstance(item, dict):
+                raise ValueError("session.historico contém item inválido")
+            role, content = item.get("role"), item.get("content")
+            if not isinstance(role, str) or not isinstance(content, str):
+                raise ValueError("session.historico: role e content devem ser texto")
+            sessao.historico.append(role, content)
+        return sessao
+
+    def para_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "nome_cliente": self.nome_cliente,
+            "formacao_cliente": self.formacao_cliente,
+            "tipo_formacao": self.tipo_formacao,
+            "area_preferencial": self.area_preferencial,
+            "historico": self.historico.para_lista(),
+            "curso_contexto": self.curso_contexto,
+        }
+
+
+def decodificar_requisicao_chat(corpo: bytes):
+    """Decodifica o corpo de POST /chat -> (mensagem, SessaoChat). Levanta ValueError se inválido."""
+    dados = json_loads(corpo)
+    if not isinstance(dados, dict):
+        raise ValueError("o corpo deve ser um objeto JSON")
+    mensagem = dados.get("mensagem")
+    if not isinstance(mensagem, str):
+        raise ValueError("mensagem deve ser texto")
+    return mensagem, SessaoChat.de_dict(dados.get("session"))
+
+
+def codificar_resposta_chat(resposta_bot: str, sessao: SessaoChat, navegar_para: Optional[str]) -> bytes:
+    return json_dumps({
+        "resposta_bot": resposta_bot,
+        "session_atualizada": sessao.para_dict(),
+        "navegar_para": navegar_para,
+    })
@@ -0,0 +1,173 @@
+"""
+Ferramentas de diagnóstico de latência (usadas pelo bot_api.py).
+
+1. Rastreio por requisição: o cliente envia o header X-Trace-Etapas: 1 e recebe um
+   header Server-Timing com o tempo gasto em cada etapa (db, prompt, geracao, parse,
+   persistencia). Sem o header, etapa() devolve um context manager nulo e compartilhado.
+2. Amostrador de perfil: captura as pilhas de todas as threads a cada intervalo, por N
+   segundos, e devolve no formato "folded" (flamegraph.pl, speedscope, inferno). O modo
+   "cpu" usa o relógio de CPU de cada thread; "wall" conta também as threads em espera.
+   Nada roda enquanto nenhum perfil é pedido.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+HEADER_RASTREIO = "x-trace-etapas"
+
+
+# === RASTREIO POR REQUISIÇÃO ===
+class Rastreio:
+    __slots__ = ("inicio", "duracoes", "chamadas")
+
+    def __init__(self) -> None:
+        self.inicio = time.perf_counter()
+        self.duracoes: Dict[str, float] = {}
+        self.chamadas: Dict[str, int] = {}
+
+    def registrar(self, nome: str, segundos: float) -> None:
+        self.duracoes[nome] = self.duracoes.get(nome, 0.0) + segundos
+        self.chamadas[nome] = self.chamadas.get(nome, 0) + 1
+
+    def server_timing(self) -> str:
+        """Valor do header Server-Timing (durações em ms)."""
+        partes = [
+            f'{nome};dur={segundos * 1000:.1f};desc="{self.chamadas[nome]}x"'
+            for nome, segundos in self.duracoes.items()
+        ]
+        partes.append(f"total;dur={(time.perf_counter() - self.inicio) * 1000:.1f}")
+        return ", ".join(partes)
+
+
+_rastreio_atual: ContextVar[Optional[Rastreio]] = ContextVar("rastreio_atual", default=None)
+
+
+class _EtapaNula:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_ETAPA_NULA = _EtapaNula()
+
+
+class _Etapa:
+    __slots__ = ("rastreio", "nome", "inicio")
+
+    def __init__(self, rastreio: Rastreio, nome: str):
+        self.rastreio = rastreio
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.rastreio.registrar(self.nome, time.perf_counter() - self.inicio)
+        return False
+
+
+def etapa(nome: str):
+    """Mede um trecho da requisição atual, se ela pediu rastreio (senão não faz nada)."""
+    rastreio = _rastreio_atual.get()
+    if rastreio is None:
+        return _ETAPA_NULA
+    return _Etapa(rastreio, nome)
+
+
+class rastrear:
+    """Ativa o rastreio para o bloco (uso: with rastrear(ativo) as rastreio: ...)."""
+    __slots__ = ("rastreio", "token")
+
+    def __init__(self, ativo: bool):
+        self.rastreio = Rastreio() if ativo else None
+        self.token = None
+
+    def __enter__(self) -> Optional[Rastreio]:
+        if self.rastreio is not None:
+            self.token = _rastreio_atual.set(self.rastreio)
+        return self.rastreio
+
+    def __exit__(self, *exc):
+        if self.token is not None:
+            _rastreio_atual.reset(self.token)
+        return False
+
+
+# === AMOSTRADOR DE PERFIL (CPU / WALL) ===
+# No modo "wall" toda thread entra em toda amostra. No modo "cpu" só entram as threads cujo
+# relógio de CPU (por thread, do sistema operacional) andou desde a amostra anterior: threads
+# paradas em I/O, locks, time.sleep ou dentro de chamadas C bloqueantes (gRPC do Gemini,
+# HTTP do Supabase) ficam de fora, independente da função em que estão.
+PERFIL_CPU_DISPONIVEL = hasattr(time, "pthread_getcpuclockid")
+
+_trava_perfil = threading.Lock()
+
+
+def _descrever_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _tempo_cpu_thread(ident: int) -> Optional[float]:
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except OSError:
+        return None  # Thread terminou entre a listagem e a leitura
+
+
+def capturar_perfil(segundos: float, modo: str = "wall", intervalo_s: float = 0.01) -> Optional[str]:
+    """
+    Amostra as pilhas de todas as threads do processo por 'segundos'.
+    Retorna o perfil em formato folded ("thread;func;func N" por linha), ou None se
+    já houver outro perfil em andamento.
+    """
+    if modo == "cpu" and not PERFIL_CPU_DISPONIVEL:
+        raise ValueError("Perfil de CPU não suportado nesta plataforma.")
+    if not _trava_perfil.acquire(blocking=False):
+        return None
+    try:
+        pilhas: Counter = Counter()
+        minha_thread = threading.get_ident()
+        # (ident, native_id) -> último tempo de CPU; o native_id separa threads novas que
+        # reaproveitaram o ident de uma thread que terminou
+        tempos_cpu: Dict[tuple, float] = {}
+        fim = time.monotonic() + segundos
+        while time.monotonic() < fim:
+            # Threads entram e saem (os workers do AnyIO morrem ociosos e são substituídos,
+            # às vezes com o mesmo ident): o mapa é refeito a cada amostra (custa microssegundos)
+            threads = {t.ident: t for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == minha_thread:
+                    continue
+                thread = threads.get(ident)
+                if modo == "cpu":
+                    # Só threads vivas do threading (ident válido para pthread_getcpuclockid)
+                    if thread is None:
+                        continue
+                    tempo = _tempo_cpu_thread(ident)
+                    if tempo is None:
+                        continue
+                    chave = (ident, thread.native_id)
+                    anterior = tempos_cpu.get(chave)
+                    tempos_cpu[chave] = tempo
+                    if anterior is None or tempo <= anterior:
+                        continue  # Primeira leitura (sem referência) ou thread ociosa
+                pilha = []
+                while frame is not None:
+                    pilha.append(_descrever_frame(frame))
+                    frame = frame.f_back
+                pilha.append(thread.name if thread is not None else f"thread-{ident}")
+                pilhas[";".join(reversed(pilha))] += 1
+            time.sleep(intervalo_s)
+        return "".join(f"{pilha} {n}\n" for pilha, n in pilhas.most_common())
+    finally:
+        _trava_perfil.release()
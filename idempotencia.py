@@ -0,0 +1,134 @@
+"""
+Idempotência do POST /chat (usada pelo bot_api.py).
+
+- Cada requisição tem uma chave: o header Idempotency-Key enviado pelo widget ou, na
+  falta dele, o hash do corpo DENTRO da conversa (session_id). Duplicatas simultâneas
+  esperam a MESMA execução em andamento; duplicatas posteriores recebem a resposta
+  guardada por alguns minutos.
+- Sem Idempotency-Key e sem session_id não há chave: dois visitantes abrindo o chat na
+  mesma página mandam corpos idênticos e NÃO podem receber a mesma conversa.
+- Turnos da mesma conversa (session_id) são executados um de cada vez.
+
+Tudo roda no event loop do FastAPI (um processo), então não há travas de thread aqui.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+TTL_RESULTADOS_S = 120
+MAX_RESULTADOS = 1000
+
+
+class ConflitoIdempotencia(Exception):
+    """A mesma chave de idempotência foi reutilizada com um corpo diferente."""
+
+
+def impressao_digital(corpo: bytes) -> str:
+    return hashlib.sha256(corpo).hexdigest()
+
+
+def montar_chave(idempotency_key: Optional[str], session_id: Optional[str], impressao: str) -> Optional[str]:
+    """Chave de idempotência, ou None se a requisição não deve ser coalescida."""
+    if idempotency_key:
+        return f"{session_id or '-'}:{idempotency_key}"
+    if session_id:
+        return f"{session_id}:corpo:{impressao}"
+    return None
+
+
+class CoordenadorIdempotencia:
+    def __init__(self, ttl_s: float = TTL_RESULTADOS_S, max_resultados: int = MAX_RESULTADOS):
+        self.ttl_s = ttl_s
+        self.max_resultados = max_resultados
+        # chave -> (expira_em, impressao, resultado)
+        self._resultados: "OrderedDict[str, Tuple[float, str, bytes]]" = OrderedDict()
+        # chave -> (impressao, future da execução em andamento)
+        self._em_andamento: Dict[str, Tuple[str, asyncio.Future]] = {}
+        # session_id -> [lock, nº de turnos usando/esperando]
+        self._travas_sessao: Dict[str, List] = {}
+        self.estatisticas = {"execucoes": 0, "coalescidas": 0, "repetidas": 0}
+
+    def _limpar_expirados(self, agora: float) -> None:
+        while self._resultados:
+            chave, (expira_em, _, _) = next(iter(self._resultados.items()))
+            if expira_em > agora and len(self._resultados) <= self.max_resultados:
+                break
+            self._resultados.popitem(last=False)
+
+    @asynccontextmanager
+    async def trava_sessao(self, session_id: Optional[str]):
+        """Serializa os turnos de uma mesma conversa (conversas novas não têm ID ainda)."""
+        if not session_id:
+            yield
+            return
+        entrada = self._travas_sessao.get(session_id)
+        if entrada is None:
+            entrada = self._travas_sessao[session_id] = [asyncio.Lock(), 0]
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._travas_sessao[session_id]
+
+    async def executar(
+        self,
+        chave: Optional[str],
+        impressao: str,
+        session_id: Optional[str],
+        funcao: Callable[[], Awaitable[bytes]],
+    ) -> Tuple[bytes, bool]:
+        """
+        Executa 'funcao' no máximo uma vez por chave dentro do TTL (sem chave, sempre executa).
+        Retorna (resultado, reaproveitado). Levanta ConflitoIdempotencia se a chave
+        já foi usada com outro corpo.
+        """
+        if chave is None:
+            self.estatisticas["execucoes"] += 1
+            async with self.trava_sessao(session_id):
+                return await funcao(), False
+
+        agora = time.monotonic()
+        self._limpar_expirados(agora)
+
+        guardado = self._resultados.get(chave)
+        if guardado:
+            _, impressao_guardada, resultado = guardado
+            if impressao_guardada != impressao:
+                raise ConflitoIdempotencia(chave)
+            self.estatisticas["repetidas"] += 1
+            return resultado, True
+
+        andamento = self._em_andamento.get(chave)
+        if andamento:
+            impressao_andamento, future = andamento
+            if impressao_andamento != impressao:
+                raise ConflitoIdempotencia(chave)
+            self.estatisticas["coalescidas"] += 1
+            # shield: se este cliente desconectar, a execução original continua
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._em_andamento[chave] = (impressao, future)
+        self.estatisticas["execucoes"] += 1
+        try:
+            async with self.trava_sessao(session_id):
+                resultado = await funcao()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # marca como lida (evita aviso quando ninguém mais espera)
+            raise
+        finally:
+            del self._em_andamento[chave]
+
+        future.set_result(resultado)
+        self._resultados[chave] = (time.monotonic() + self.ttl_s, impressao, resultado)
+        return resultado, False
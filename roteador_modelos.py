@@ -0,0 +1,170 @@
+"""
+Roteamento de modelos do Gemini por nível (usado pelo bot_api.py).
+
+Cada turno que vai para a IA é classificado de forma barata (etapa da conversa, tamanho da
+mensagem, presença de dados de curso) em um nível. Os níveis ficam configurados em um único
+lugar (NIVEIS_MODELO no bot_api.py), e cada um tem seu modelo, configuração de geração,
+orçamento de latência e preço. Se o nível escolhido não responder dentro do orçamento, uma
+requisição "hedge" é disparada no nível reserva e vale a primeira resposta que chegar.
+O orçamento conta a partir do início da chamada (não da fila do executor), e com todos os
+workers ocupados não há hedge: sob carga ele só aumentaria a fila e o gasto.
+
+Os modelos só precisam ter generate_content(prompt, generation_config=...), então modelos
+falsos (com atrasos controlados) servem para testar o roteador.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional, Tuple
+
+# Mensagens curtas de cortesia / confirmação (não precisam do modelo mais caro)
+MENSAGENS_SIMPLES = {"oi", "ola", "olá", "ok", "okay", "sim", "nao", "não", "obrigado", "obrigada", "valeu",
+                     "beleza", "blz", "certo", "entendi", "legal", "show", "perfeito", "bom dia", "boa tarde", "boa noite"}
+# Sinais de objeção / negociação (ficam no nível padrão)
+SINAIS_OBJECAO = ("caro", "desconto", "parcel", "pensar", "não sei", "nao sei", "garantia", "confi", "reconhecid", "cancel", "dúvida", "duvida")
+
+MAX_PALAVRAS_TURNO_SIMPLES = 6
+AMOSTRAS_LATENCIA = 500
+
+
+def classificar_turno(mensagem: str, qtd_historico: int, tem_dados_curso: bool) -> str:
+    """Escolhe o nível ('rapido' ou 'padrao') para o turno."""
+    msg = mensagem.strip().lower().rstrip("!.?")
+    if mensagem == "...iniciar...":
+        return "rapido"  # Saudação inicial
+    if any(sinal in msg for sinal in SINAIS_OBJECAO):
+        return "padrao"
+    if msg in MENSAGENS_SIMPLES:
+        return "rapido"
+    if not tem_dados_curso and qtd_historico <= 4 and len(msg.split()) <= MAX_PALAVRAS_TURNO_SIMPLES:
+        return "rapido"  # Início de conversa, ainda sem curso em foco
+    return "padrao"
+
+
+class NivelModelo:
+    __slots__ = ("nome", "modelo", "configuracao", "orcamento_s", "custo_entrada_1m", "custo_saida_1m")
+
+    def __init__(self, nome: str, modelo: Any, configuracao: Any, orcamento_s: float,
+                 custo_entrada_1m: float = 0.0, custo_saida_1m: float = 0.0):
+        self.nome = nome
+        self.modelo = modelo
+        self.configuracao = configuracao
+        self.orcamento_s = orcamento_s
+        self.custo_entrada_1m = custo_entrada_1m
+        self.custo_saida_1m = custo_saida_1m
+
+
+def _contar_tokens(resposta: Any, prompt: str, texto: str) -> Tuple[int, int]:
+    uso = getattr(resposta, "usage_metadata", None)
+    if uso is not None and getattr(uso, "prompt_token_count", None):
+        return uso.prompt_token_count, getattr(uso, "candidates_token_count", 0) or 0
+    # Estimativa grosseira (~4 caracteres por token) para modelos sem usage_metadata
+    return len(prompt) // 4, len(texto) // 4
+
+
+class RoteadorModelos:
+    def __init__(self, niveis: Dict[str, NivelModelo], reservas: Dict[str, str], max_paralelo: int = 16):
+        self.niveis = niveis
+        self.reservas = reservas
+        self.max_paralelo = max_paralelo
+        self._executor = ThreadPoolExecutor(max_workers=max_paralelo, thread_name_prefix="gemini")
+        self._trava = threading.Lock()
+        self._em_andamento = 0  # Chamadas submetidas e ainda não concluídas (rodando ou na fila)
+        self._estatisticas = {
+            nome: {"chamadas": 0, "respostas": 0, "erros": 0, "hedges_disparados": 0,
+                   "hedges_evitados": 0, "tokens_entrada": 0, "tokens_saida": 0, "custo_usd": 0.0,
+                   "latencias_ms": deque(maxlen=AMOSTRAS_LATENCIA)}
+            for nome in niveis
+        }
+
+    def _concluir(self, _futuro) -> None:
+        with self._trava:
+            self._em_andamento -= 1
+
+    def _submeter(self, nivel: NivelModelo, prompt: str, iniciou: Optional[threading.Event] = None):
+        with self._trava:
+            self._em_andamento += 1
+        futuro = self._executor.submit(self._chamar, nivel, prompt, iniciou)
+        futuro.add_done_callback(self._concluir)
+        return futuro
+
+    def _chamar(self, nivel: NivelModelo, prompt: str, iniciou: Optional[threading.Event] = None) -> Tuple[Any, str, float]:
+        inicio = time.perf_counter()
+        if iniciou is not None:
+            iniciou.set()
+        with self._trava:
+            self._estatisticas[nivel.nome]["chamadas"] += 1
+        try:
+            resposta = nivel.modelo.generate_content(prompt, generation_config=nivel.configuracao)
+            texto = resposta.text
+        except Exception:
+            with self._trava:
+                self._estatisticas[nivel.nome]["erros"] += 1
+            raise
+        latencia = time.perf_counter() - inicio
+        entrada, saida = _contar_tokens(resposta, prompt, texto)
+        with self._trava:
+            estat = self._estatisticas[nivel.nome]
+            estat["latencias_ms"].append(latencia * 1000)
+            estat["tokens_entrada"] += entrada
+            estat["tokens_saida"] += saida
+            estat["custo_usd"] += (entrada * nivel.custo_entrada_1m + saida * nivel.custo_saida_1m) / 1_000_000
+        return resposta, nivel.nome, latencia
+
+    def gerar(self, nome_nivel: str, prompt: str) -> Tuple[Any, str]:
+        """
+        Gera no nível pedido, com hedge no nível reserva se o orçamento de latência estourar
+        (ou se o primário falhar). Retorna (resposta do modelo, nível que respondeu).
+        As chamadas perdedoras não são canceladas (a API não permite); só são ignoradas.
+        """
+        primario = self.niveis[nome_nivel]
+        nome_reserva = self.reservas.get(nome_nivel)
+        reserva = self.niveis.get(nome_reserva) if nome_reserva else None
+
+        iniciou = threading.Event()
+        futuros = [self._submeter(primario, prompt, iniciou)]
+        iniciou.wait()  # Espera na fila do executor não conta no orçamento
+        prontos, _ = wait(futuros, timeout=primario.orcamento_s)
+
+        primario_ok = prontos and futuros[0].exception() is None
+        if not primario_ok and reserva is not None:
+            # Se o primário falhou, a reserva substitui a chamada. Se só está lento, o hedge
+            # duplica o trabalho: com o executor cheio ele iria para a fila, então não dispara.
+            with self._trava:
+                disparar = bool(prontos) or self._em_andamento < self.max_paralelo
+                self._estatisticas[primario.nome]["hedges_disparados" if disparar else "hedges_evitados"] += 1
+            motivo = "falhou" if prontos else f"passou de {primario.orcamento_s}s"
+            if disparar:
+                print(f"LOG (Python): Nível '{primario.nome}' {motivo}. Disparando hedge em '{reserva.nome}'.")
+                futuros.append(self._submeter(reserva, prompt))
+            else:
+                print(f"LOG (Python): Nível '{primario.nome}' {motivo}, mas o executor está cheio. Sem hedge.")
+
+        # Vale a primeira resposta bem-sucedida; erro só se todas falharem
+        pendentes = set(futuros)
+        erro: Optional[BaseException] = None
+        while pendentes:
+            prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                if futuro.exception() is None:
+                    resposta, nome_vencedor, _ = futuro.result()
+                    with self._trava:
+                        self._estatisticas[nome_vencedor]["respostas"] += 1
+                    return resposta, nome_vencedor
+                erro = futuro.exception()
+        raise erro
+
+    def relatorio(self) -> Dict[str, Dict]:
+        """Custo e latência (p50/p95) por nível."""
+        with self._trava:
+            relatorio = {}
+            for nome, estat in self._estatisticas.items():
+                latencias = sorted(estat["latencias_ms"])
+                relatorio[nome] = {
+                    **{k: v for k, v in estat.items() if k != "latencias_ms"},
+                    "custo_usd": round(estat["custo_usd"], 6),
+                    "latencia_p50_ms": round(latencias[len(latencias) // 2], 1) if latencias else None,
+                    "latencia_p95_ms": round(latencias[int(len(latencias) * 0.95)], 1) if latencias else None,
+                }
+            return relatorio
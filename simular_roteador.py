@@ -0,0 +1,113 @@
+"""
+Simulação do roteador de modelos (roteador_modelos.py) com modelos falsos.
+
+Cada modelo falso tem atraso e falha configuráveis; nenhum acesso ao Gemini nem ao bot_api.
+Cenários verificados:
+  - classificação dos turnos em níveis
+  - primário dentro do orçamento: sem hedge
+  - primário lento: hedge no nível reserva, vale a reserva
+  - primário com erro: a reserva responde
+  - tempo na fila do executor não conta no orçamento
+  - executor cheio: sem hedge
+Uso: python simular_roteador.py
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+from roteador_modelos import NivelModelo, RoteadorModelos, classificar_turno
+
+
+class ModeloFalso:
+    def __init__(self, nome: str, atraso_s: float = 0.0, falhar: bool = False):
+        self.nome = nome
+        self.atraso_s = atraso_s
+        self.falhar = falhar
+        self.chamadas = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        self.chamadas += 1
+        time.sleep(self.atraso_s)
+        if self.falhar:
+            raise RuntimeError(f"{self.nome} indisponível")
+        return SimpleNamespace(text=f"resposta do {self.nome}", usage_metadata=None)
+
+
+def montar_roteador(rapido: ModeloFalso, padrao: ModeloFalso, orcamento_s: float, max_paralelo: int = 16) -> RoteadorModelos:
+    niveis = {
+        "rapido": NivelModelo("rapido", rapido, None, orcamento_s, 0.10, 0.40),
+        "padrao": NivelModelo("padrao", padrao, None, orcamento_s, 0.30, 2.50),
+    }
+    return RoteadorModelos(niveis, {"rapido": "padrao", "padrao": "rapido"}, max_paralelo=max_paralelo)
+
+
+def em_paralelo(roteador: RoteadorModelos, n: int, nivel: str = "rapido") -> list:
+    resultados = [None] * n
+
+    def rodar(i):
+        resultados[i] = roteador.gerar(nivel, "prompt")[1]
+
+    threads = [threading.Thread(target=rodar, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return resultados
+
+
+def cenario_classificacao():
+    assert classificar_turno("...iniciar...", 0, False) == "rapido"
+    assert classificar_turno("Obrigado!", 8, True) == "rapido"
+    assert classificar_turno("achei caro, tem desconto?", 2, False) == "padrao"
+    assert classificar_turno("quero saber sobre o curso de neuropsicopedagogia e a carga horária", 6, True) == "padrao"
+
+
+def cenario_sem_hedge():
+    roteador = montar_roteador(ModeloFalso("rapido", 0.05), ModeloFalso("padrao"), orcamento_s=0.5)
+    _, nivel = roteador.gerar("rapido", "prompt")
+    assert nivel == "rapido"
+    assert roteador.relatorio()["rapido"]["hedges_disparados"] == 0
+
+
+def cenario_hedge_por_latencia():
+    padrao = ModeloFalso("padrao", 0.05)
+    roteador = montar_roteador(ModeloFalso("rapido", 1.0), padrao, orcamento_s=0.2)
+    inicio = time.perf_counter()
+    _, nivel = roteador.gerar("rapido", "prompt")
+    assert nivel == "padrao" and padrao.chamadas == 1
+    assert time.perf_counter() - inicio < 0.6  # Não esperou o primário lento
+    assert roteador.relatorio()["rapido"]["hedges_disparados"] == 1
+
+
+def cenario_falha():
+    roteador = montar_roteador(ModeloFalso("rapido", falhar=True), ModeloFalso("padrao"), orcamento_s=0.5)
+    _, nivel = roteador.gerar("rapido", "prompt")
+    assert nivel == "padrao"
+    relatorio = roteador.relatorio()
+    assert relatorio["rapido"]["erros"] == 1 and relatorio["padrao"]["respostas"] == 1
+
+
+def cenario_fila_nao_conta():
+    # Dois workers ocupados por 0.4s; a chamada espera na fila e depois roda em 0.1s (< 0.3s)
+    roteador = montar_roteador(ModeloFalso("rapido", 0.1), ModeloFalso("padrao"), orcamento_s=0.3, max_paralelo=2)
+    for _ in range(2):
+        roteador._executor.submit(time.sleep, 0.4)
+    _, nivel = roteador.gerar("rapido", "prompt")
+    assert nivel == "rapido"
+    assert roteador.relatorio()["rapido"]["hedges_disparados"] == 0
+
+
+def cenario_executor_cheio():
+    padrao = ModeloFalso("padrao")
+    roteador = montar_roteador(ModeloFalso("rapido", 0.5), padrao, orcamento_s=0.1, max_paralelo=2)
+    assert em_paralelo(roteador, 2) == ["rapido", "rapido"]
+    relatorio = roteador.relatorio()["rapido"]
+    assert padrao.chamadas == 0
+    assert relatorio["hedges_disparados"] == 0 and relatorio["hedges_evitados"] == 2
+
+
+if __name__ == "__main__":
+    for cenario in (cenario_classificacao, cenario_sem_hedge, cenario_hedge_por_latencia,
+                    cenario_falha, cenario_fila_nao_conta, cenario_executor_cheio):
+        cenario()
+        print(f"ok  {cenario.__name__}")
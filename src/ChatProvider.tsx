@@ -2,7 +2,25 @@ import { createContext, useContext, useState, ReactNode, useEffect } from "react
 import { useLocation, useNavigate } from "react-router-dom"; // Importa hooks de navegação
 import { toast } from "sonner";
 
-const API_URL = "http://127.0.0.1:8000/chat";
+const API_BASE_URL = "http://127.0.0.1:8000";
+const API_URL = `${API_BASE_URL}/chat`;
+const SESSION_ID_STORAGE_KEY = "chat_session_id"; // ID da conversa gerado pelo backend
+
+// Envia para a API com uma Idempotency-Key: se a primeira tentativa falhar na rede,
+// o retry reutiliza a mesma chave e o backend não processa a mensagem duas vezes.
+const postChat = async (payload: unknown): Promise<Response> => {
+  const init: RequestInit = {
+    method: "POST",
+    headers: { "Content-Type": "application/json", "Idempotency-Key": crypto.randomUUID() },
+    body: JSON.stringify(payload),
+  };
+  try {
+    return await fetch(API_URL, init);
+  } catch (error) {
+    console.warn("LOG (ChatProvider): Falha de rede. Repetindo envio com a mesma Idempotency-Key.", error);
+    return await fetch(API_URL, init);
+  }
+};
 
 // 1. Define as estruturas (espelhando o Python)
 interface ChatMessage {
@@ -11,6 +29,7 @@ interface ChatMessage {
 }
 
 interface ChatSession {
+  session_id: string | null;
   nome_cliente: string;
   formacao_cliente: string | null;
   tipo_formacao: string | null;
@@ -42,6 +61,7 @@ const ChatContext = createContext<ChatContextType | undefined>(undefined);
 // 4. Cria o Provedor
 export const ChatProvider = ({ children }: { children: ReactNode }) => {
   const [session, setSession] = useState<ChatSession>({
+    session_id: sessionStorage.getItem(SESSION_ID_STORAGE_KEY),
     nome_cliente: "visitante",
     formacao_cliente: null,
     tipo_formacao: null,
@@ -67,6 +87,46 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
     setIsOpen(false);
   }, [location.pathname]); // Dispara a cada mudança de URL
 
+  // Guarda o ID da conversa para poder retomá-la após recarregar a página
+  useEffect(() => {
+    if (session.session_id) {
+      sessionStorage.setItem(SESSION_ID_STORAGE_KEY, session.session_id);
+    }
+  }, [session.session_id]);
+
+  // Retoma uma conversa existente (última página do histórico + perfil salvos no backend)
+  const resumeConversation = async (sessionId: string): Promise<boolean> => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/historico/${sessionId}?limite=50`);
+      if (!response.ok) return false;
+
+      const data = await response.json();
+      const historico: ChatMessage[] = data.mensagens
+        .filter((m: { role: string }) => m.role === "user" || m.role === "assistant")
+        .map((m: ChatMessage) => ({ role: m.role, content: m.content }));
+
+      if (historico.length === 0) return false;
+
+      // Sem o perfil salvo, a conversa voltaria como "visitante" e sem curso: melhor recomeçar
+      if (!data.perfil) return false;
+
+      console.log(`LOG (ChatProvider): Conversa ${sessionId} retomada com ${historico.length} mensagens.`);
+      setSession(prev => ({
+        ...prev,
+        nome_cliente: data.perfil.nome_cliente,
+        formacao_cliente: data.perfil.formacao_cliente,
+        tipo_formacao: data.perfil.tipo_formacao,
+        area_preferencial: data.perfil.area_preferencial,
+        curso_contexto: data.perfil.curso_contexto,
+        historico,
+      }));
+      return true;
+    } catch (error) {
+      console.error("Erro ao retomar conversa:", error);
+      return false;
+    }
+  };
+
   // Função para enviar saudação inicial
   const getInitialGreeting = async (currentContext: string | null) => {
     console.log(`LOG (ChatProvider): Iniciando chat com contexto: ${currentContext || 'Nenhum'}`);
@@ -85,11 +145,7 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
         session: initialSession
       };
 
-      const response = await fetch(API_URL, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(payload),
-      });
+      const response = await postChat(payload);
 
       if (!response.ok) throw new Error("Erro ao conectar com o assistente.");
 
@@ -133,11 +189,7 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
       };
 
       console.log("LOG (ChatProvider): Enviando para API Python:", payload);
-      const response = await fetch(API_URL, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(payload),
-      });
+      const response = await postChat(payload);
 
       if (!response.ok) throw new Error("Erro ao processar sua mensagem.");
       
@@ -178,13 +230,14 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
   };
   
   // Funções de controle do Popover/Drawer
-  const openChat = () => {
-    // Ao abrir, se o histórico estiver vazio, busca a saudação
+  const openChat = async () => {
+    setIsOpen(true);
+    // Ao abrir, se o histórico estiver vazio, tenta retomar a conversa salva; senão busca a saudação
     // O 'curso_contexto' já deve ter sido setado pelo 'setCourseContext'
     if (session.historico.length === 0) {
-      getInitialGreeting(session.curso_contexto);
+      const resumed = session.session_id ? await resumeConversation(session.session_id) : false;
+      if (!resumed) getInitialGreeting(session.curso_contexto);
     }
-    setIsOpen(true);
   };
   const closeChat = () => setIsOpen(false);
   const toggleChat = () => {
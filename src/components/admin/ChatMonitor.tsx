@@ -11,6 +11,7 @@ import { Badge } from "@/components/ui/badge";
 
 // Interface para as informações do Cliente
 interface ClientProfile {
+  session_id: string; // ID da conversa (gerado pelo backend)
   nome_cliente: string;
   formacao_cliente: string | null;
   tipo_formacao: string | null;
@@ -28,93 +29,64 @@ interface ChatMessage {
   created_at: string;
 }
 
+const TAMANHO_PAGINA_MENSAGENS = 200;
+const MAX_SESSOES_LISTADAS = 50;
+// ID gerado pelo backend: UUID, com ou sem a assinatura (".<assinatura>")
+const UUID_REGEX = /^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(\.[\w-]+)?$/i;
+
+// Perfil salvo pelo backend em chat_sessoes (nome e etiquetas não ficam em chat_messages)
+const montarPerfil = (sessionId: string, lastMessageAt: string, row?: Partial<ClientProfile> | null): ClientProfile => ({
+  session_id: sessionId,
+  // Conversas antigas (antes do ID gerado pelo backend) usavam o nome como session_id
+  nome_cliente: row?.nome_cliente && row.nome_cliente !== "visitante"
+    ? row.nome_cliente
+    : UUID_REGEX.test(sessionId) ? "Visitante" : sessionId,
+  formacao_cliente: row?.formacao_cliente ?? null,
+  tipo_formacao: row?.tipo_formacao ?? null,
+  area_preferencial: row?.area_preferencial ?? null,
+  curso_contexto: row?.curso_contexto ?? null,
+  last_message_at: lastMessageAt,
+});
+
 export const ChatMonitor = () => {
   const [sessions, setSessions] = useState<ClientProfile[]>([]); // Agora armazena ClientProfile
   const [selectedSessionId, setSelectedSessionId] = useState<string | null>(null);
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [clientProfile, setClientProfile] = useState<ClientProfile | null>(null);
   const [loading, setLoading] = useState(false);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
 
-  // Função auxiliar para extrair o perfil (contexto) a partir do histórico
-  const fetchSessionProfile = useCallback(async (sessionId: string) => {
-    // Busca as últimas 20 mensagens para tentar pegar o contexto mais recente
-    const { data: msgs } = await supabase
-      .from("chat_messages")
-      .select("content, created_at")
+  const fetchSessionProfile = useCallback(async (sessionId: string, lastMessageAt: string) => {
+    const { data } = await supabase
+      .from("chat_sessoes")
+      .select("nome_cliente, formacao_cliente, tipo_formacao, area_preferencial, curso_contexto")
       .eq("session_id", sessionId)
-      .order("created_at", { ascending: false })
-      .limit(20);
-
-    let profile: ClientProfile = {
-      nome_cliente: "Visitante",
-      formacao_cliente: null,
-      tipo_formacao: null,
-      area_preferencial: null,
-      curso_contexto: null,
-      last_message_at: msgs?.[0]?.created_at || new Date().toISOString(),
-    };
-
-    // Itera as últimas mensagens para tentar reconstruir o contexto
-    for (const msg of msgs || []) {
-        // Tenta encontrar o bloco de dados do curso injetado pelo backend
-      const matchCursoContexto = msg.content.match(/\[DADOS_CURSO_ENCONTRADO:\s*(.*?)\]/);
-      if (matchCursoContexto && !profile.curso_contexto) {
-        profile.curso_contexto = matchCursoContexto[1].trim();
-      }
-      
-      // Tenta encontrar o nome do cliente (o backend envia o nome do cliente no content do HIDDEN se estiver atualizado)
-      const matchNome = msg.content.match(/^- \*\*Nome:\*\* (.*?)\n/m);
-      if (matchNome && profile.nome_cliente === "Visitante" && matchNome[1] !== "visitante") {
-          profile.nome_cliente = matchNome[1].trim();
-      }
-
-      // Se encontrarmos o contexto do curso e o nome, podemos parar (otimização)
-      if (profile.curso_contexto !== null && profile.nome_cliente !== "Visitante") {
-          break;
-      }
-    }
-    
-    // Se o nome ainda for "Visitante" e o session_id não for um UUID, usa o session_id como nome
-    if (profile.nome_cliente === "Visitante" && !sessionId.match(/^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$/i)) {
-      profile.nome_cliente = sessionId;
-    }
-
-    return profile;
+      .maybeSingle();
+    return montarPerfil(sessionId, lastMessageAt, data);
   }, []);
 
-  // 1. Buscar sessões ativas (agrupando mensagens)
+  // 1. Buscar conversas recentes direto de chat_sessoes (índice updated_at DESC)
   const fetchSessions = async () => {
     setLoading(true);
     try {
       const { data, error } = await supabase
-        .from("chat_messages")
-        .select("session_id, created_at")
-        .order("created_at", { ascending: false })
-        .limit(200);
+        .from("chat_sessoes")
+        .select("session_id, nome_cliente, formacao_cliente, tipo_formacao, area_preferencial, curso_contexto, updated_at")
+        .order("updated_at", { ascending: false })
+        .limit(MAX_SESSOES_LISTADAS);
 
       if (error) throw error;
 
-      // Agrupa e pega o timestamp mais recente para cada session_id
-      const recentSessionsMap = new Map<string, string>();
-      data?.forEach(m => {
-          if (!recentSessionsMap.has(m.session_id)) {
-              recentSessionsMap.set(m.session_id, m.created_at);
-          }
-      });
-      
-      const uniqueSessionIds = Array.from(recentSessionsMap.keys());
-      const profilesPromises = uniqueSessionIds.map(id => fetchSessionProfile(id));
-      const profiles = await Promise.all(profilesPromises);
-      
-      // Atualiza o estado das sessões com os perfis encontrados
-      setSessions(profiles.sort((a, b) => new Date(b.last_message_at).getTime() - new Date(a.last_message_at).getTime()));
+      const profiles = (data || []).map(row => montarPerfil(row.session_id, row.updated_at, row));
+      setSessions(profiles);
       
       if (!selectedSessionId && profiles.length > 0) {
-        setSelectedSessionId(profiles[0].nome_cliente); // Usando o nome_cliente/ID como o selecionado
+        setSelectedSessionId(profiles[0].session_id);
         setClientProfile(profiles[0]);
       } else if (selectedSessionId) {
         // Se já tinha um selecionado, atualiza o perfil desse
-        const currentProfile = profiles.find(p => p.nome_cliente === selectedSessionId);
+        const currentProfile = profiles.find(p => p.session_id === selectedSessionId);
         if(currentProfile) setClientProfile(currentProfile);
       }
       
@@ -125,16 +97,42 @@ export const ChatMonitor = () => {
     }
   };
 
-  // 2. Buscar mensagens da sessão selecionada
-  const fetchMessages = async (sessionId: string) => {
-    const { data, error } = await supabase
+  // 2. Buscar mensagens da sessão selecionada, uma página por vez (keyset em created_at + id,
+  //    como o buscar_historico_sessao do backend). Sem cursor: página mais recente.
+  const fetchMessages = async (sessionId: string, cursor: ChatMessage | null = null) => {
+    let query = supabase
       .from("chat_messages")
       .select("*")
-      .eq("session_id", sessionId)
-      .order("created_at", { ascending: true });
+      .eq("session_id", sessionId);
+    if (cursor) {
+      query = query.or(
+        `created_at.lt."${cursor.created_at}",and(created_at.eq."${cursor.created_at}",id.lt.${cursor.id})`
+      );
+    }
+    // Pedimos 1 linha a mais só para saber se existe página anterior
+    const { data, error } = await query
+      .order("created_at", { ascending: false })
+      .order("id", { ascending: false })
+      .limit(TAMANHO_PAGINA_MENSAGENS + 1);
 
-    if (error) console.error("Erro ao buscar mensagens:", error);
-    else setMessages(data || []);
+    if (error) {
+      console.error("Erro ao buscar mensagens:", error);
+      return;
+    }
+    const linhas = data || [];
+    setHasOlderMessages(linhas.length > TAMANHO_PAGINA_MENSAGENS);
+    const pagina = linhas.slice(0, TAMANHO_PAGINA_MENSAGENS).reverse();
+    setMessages(prev => (cursor ? [...pagina, ...prev] : pagina));
+  };
+
+  const loadOlderMessages = async () => {
+    if (!selectedSessionId || messages.length === 0) return;
+    setLoadingOlder(true);
+    try {
+      await fetchMessages(selectedSessionId, messages[0]);
+    } finally {
+      setLoadingOlder(false);
+    }
   };
 
   // Efeito principal: carrega sessões e, se mudar a sessão, carrega mensagens e perfil
@@ -154,7 +152,7 @@ export const ChatMonitor = () => {
               setMessages((prev) => [...prev, payload.new as ChatMessage]);
             }
             // Atualiza o perfil para pegar o novo contexto/nome
-            fetchSessionProfile(selectedSessionId);
+            fetchSessionProfile(selectedSessionId, payload.new.created_at).then(setClientProfile);
           }
           // Se for nova sessão, atualiza a lista de sessões
           fetchSessions();
@@ -169,9 +167,9 @@ export const ChatMonitor = () => {
 
   // Quando muda a seleção
   const handleSessionSelect = async (profile: ClientProfile) => {
-      setSelectedSessionId(profile.nome_cliente);
+      setSelectedSessionId(profile.session_id);
       setClientProfile(profile);
-      await fetchMessages(profile.nome_cliente); // Usamos o nome_cliente como ID da sessão
+      await fetchMessages(profile.session_id);
   };
 
   // Filtra mensagens HIDDEN para o display
@@ -198,10 +196,10 @@ export const ChatMonitor = () => {
             <div className="flex flex-col p-2 gap-1">
               {sessions.map((profile) => (
                 <button
-                  key={profile.nome_cliente}
+                  key={profile.session_id}
                   onClick={() => handleSessionSelect(profile)}
                   className={`flex items-center gap-3 p-3 rounded-lg text-left transition-colors ${
-                    selectedSessionId === profile.nome_cliente
+                    selectedSessionId === profile.session_id
                       ? "bg-accent text-accent-foreground"
                       : "hover:bg-muted"
                   }`}
@@ -241,6 +239,13 @@ export const ChatMonitor = () => {
           {/* 2.1: Chat History */}
           <ScrollArea className="h-[350px] p-4 border-b">
             <div className="space-y-4">
+              {hasOlderMessages && (
+                <div className="flex justify-center">
+                  <Button variant="outline" size="sm" onClick={loadOlderMessages} disabled={loadingOlder}>
+                    {loadingOlder ? "Carregando..." : "Carregar mensagens anteriores"}
+                  </Button>
+                </div>
+              )}
               {messagesToDisplay.map((msg) => {
                 const isBot = msg.role === "assistant";
                 const isError = msg.role === "system_error";
@@ -311,7 +316,16 @@ export const ChatMonitor = () => {
                           {clientProfile?.curso_contexto || "Nenhum"}
                       </Badge>
                   </div>
-                  {/* Outras etiquetas (Formação, etc) viriam aqui se as resgatassemos, mas por agora, foco no curso */}
+                  <div className="flex items-center gap-2">
+                      <GraduationCap className="h-4 w-4 text-muted-foreground" />
+                      <span className="font-medium">Formação:</span>
+                      {clientProfile?.formacao_cliente
+                        ? `${clientProfile.formacao_cliente}${clientProfile.tipo_formacao ? ` (${clientProfile.tipo_formacao})` : ""}`
+                        : "Não informada"}
+                  </div>
+                  <div className="flex items-center gap-2">
+                      <span className="font-medium">Área Preferencial:</span> {clientProfile?.area_preferencial || "Não definida"}
+                  </div>
               </div>
           </div>
           
@@ -67,6 +67,39 @@ export type Database = {
         }
         Relationships: []
       }
+      chat_sessoes: {
+        Row: {
+          session_id: string
+          nome_cliente: string
+          formacao_cliente: string | null
+          tipo_formacao: string | null
+          area_preferencial: string | null
+          curso_contexto: string | null
+          created_at: string
+          updated_at: string
+        }
+        Insert: {
+          session_id: string
+          nome_cliente?: string
+          formacao_cliente?: string | null
+          tipo_formacao?: string | null
+          area_preferencial?: string | null
+          curso_contexto?: string | null
+          created_at?: string
+          updated_at?: string
+        }
+        Update: {
+          session_id?: string
+          nome_cliente?: string
+          formacao_cliente?: string | null
+          tipo_formacao?: string | null
+          area_preferencial?: string | null
+          curso_contexto?: string | null
+          created_at?: string
+          updated_at?: string
+        }
+        Relationships: []
+      }
       // -----------------------------------
       avaliacoes: {
         Row: {
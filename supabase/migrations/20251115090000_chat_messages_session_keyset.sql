@@ -0,0 +1,12 @@
+-- Acesso por conversa: (session_id, created_at, id)
+-- Permite ler/paginar o histórico de UMA conversa (keyset) sem varrer as demais.
+
+-- created_at faz parte da chave de paginação, então não pode ser nulo
+UPDATE public.chat_messages SET created_at = now() WHERE created_at IS NULL;
+ALTER TABLE public.chat_messages ALTER COLUMN created_at SET NOT NULL;
+
+-- O índice composto cobre também as buscas só por session_id
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created
+  ON public.chat_messages(session_id, created_at DESC, id DESC);
+
+DROP INDEX IF EXISTS public.idx_chat_messages_session;
@@ -0,0 +1,81 @@
+-- Analytics do chat: metadados por mensagem + rollups incrementais
+-- O backend grava em cada mensagem o ramo de gerar_resposta_usuario que a produziu,
+-- o curso em contexto e o link de navegação; o trigger abaixo soma tudo em
+-- chat_rollups_diarios no momento do INSERT, então os dashboards não varrem chat_messages.
+
+ALTER TABLE public.chat_messages
+  ADD COLUMN IF NOT EXISTS ramo TEXT, -- 'mensagem_usuario', 'bypass_ementa', 'llm_busca_vazia', ...
+  ADD COLUMN IF NOT EXISTS curso_contexto TEXT,
+  ADD COLUMN IF NOT EXISTS navegar_para TEXT; -- ex: '/curso/123'
+
+-- Exportação global em ordem (created_at, id) com paginação keyset
+CREATE INDEX IF NOT EXISTS idx_chat_messages_created_id
+  ON public.chat_messages(created_at, id);
+
+DROP INDEX IF EXISTS public.idx_chat_messages_created_at;
+
+-- Tabela de rollups (dia x curso x ramo)
+CREATE TABLE IF NOT EXISTS public.chat_rollups_diarios (
+  dia DATE NOT NULL,
+  curso TEXT NOT NULL DEFAULT '', -- '' = sem curso em contexto
+  ramo TEXT NOT NULL,
+  mensagens INTEGER NOT NULL DEFAULT 0,
+  sessoes_novas INTEGER NOT NULL DEFAULT 0,
+  navegacoes INTEGER NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  PRIMARY KEY (dia, curso, ramo)
+);
+
+ALTER TABLE public.chat_rollups_diarios ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Admins podem ler rollups do chat"
+  ON public.chat_rollups_diarios
+  FOR SELECT
+  USING (public.has_role(auth.uid(), 'admin'));
+
+-- Função do trigger (security definer: a tabela de rollups não aceita escrita direta)
+CREATE OR REPLACE FUNCTION public.atualizar_chat_rollups()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_sessao_nova INTEGER := 0;
+BEGIN
+  -- Mensagens antigas (sem ramo) não entram nos rollups
+  IF NEW.ramo IS NULL THEN
+    RETURN NEW;
+  END IF;
+
+  -- Primeira mensagem da conversa? (usa o índice session_id + created_at)
+  IF NOT EXISTS (
+    SELECT 1 FROM public.chat_messages
+    WHERE session_id = NEW.session_id AND id <> NEW.id
+  ) THEN
+    v_sessao_nova := 1;
+  END IF;
+
+  INSERT INTO public.chat_rollups_diarios AS r (dia, curso, ramo, mensagens, sessoes_novas, navegacoes)
+  VALUES (
+    (NEW.created_at AT TIME ZONE 'America/Sao_Paulo')::date,
+    COALESCE(NEW.curso_contexto, ''),
+    NEW.ramo,
+    1,
+    v_sessao_nova,
+    CASE WHEN NEW.navegar_para IS NOT NULL THEN 1 ELSE 0 END
+  )
+  ON CONFLICT (dia, curso, ramo) DO UPDATE SET
+    mensagens = r.mensagens + 1,
+    sessoes_novas = r.sessoes_novas + EXCLUDED.sessoes_novas,
+    navegacoes = r.navegacoes + EXCLUDED.navegacoes,
+    updated_at = now();
+
+  RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER trg_chat_messages_rollups
+  AFTER INSERT ON public.chat_messages
+  FOR EACH ROW
+  EXECUTE FUNCTION public.atualizar_chat_rollups();
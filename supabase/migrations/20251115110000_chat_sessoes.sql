@@ -0,0 +1,26 @@
+-- Perfil atual de cada conversa (uma linha por session_id)
+-- Com o session_id gerado pelo servidor, o nome do cliente não aparece mais em chat_messages.
+-- O backend grava esta tabela (upsert) ao fim de cada turno; ela alimenta
+-- o painel de monitoramento e a retomada da conversa (GET /historico/{session_id}).
+
+CREATE TABLE IF NOT EXISTS public.chat_sessoes (
+  session_id TEXT PRIMARY KEY,
+  nome_cliente TEXT NOT NULL DEFAULT 'visitante',
+  formacao_cliente TEXT,
+  tipo_formacao TEXT,
+  area_preferencial TEXT,
+  curso_contexto TEXT,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Lista de conversas recentes do painel
+CREATE INDEX IF NOT EXISTS idx_chat_sessoes_updated_at
+  ON public.chat_sessoes(updated_at DESC);
+
+ALTER TABLE public.chat_sessoes ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Admins podem ler sessões do chat"
+  ON public.chat_sessoes
+  FOR SELECT
+  USING (public.has_role(auth.uid(), 'admin'));